@@ -0,0 +1,100 @@
+"""
+Benchmark of the euler and exact discretizations of the inertia model.
+Compares the step response of both against the analytic solution for
+growing reporting intervals, then the speed of the scalar steps and of
+helpers.model.integrate_events with either method. Requires numpy.
+
+Usage
+-----
+python benchmarks/bench_discretization.py [--events N] [--twins N] [--scalar-events N]
+
+"""
+
+# packages
+import os
+import sys
+import math
+import time
+import argparse
+
+# project
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import helpers.model as model
+from bench_model import synthesize
+
+
+def step_response(step, k, interval, steps=20, start=0.0, temperature=20.0):
+    """
+    Model a sensor jumping from start to a constant temperature.
+
+    Returns
+    -------
+    max_error : float
+        Largest deviation from the analytic solution over all steps.
+    overshoot : float
+        Largest distance past the sensor temperature.
+
+    """
+
+    value, ux = start, 0.0
+    max_error, overshoot = 0.0, 0.0
+    for i in range(1, steps + 1):
+        value = step(value, ux, temperature, ux + interval, k)
+        ux += interval
+        analytic = temperature + (start - temperature) * math.exp(-k * ux / 60)
+        max_error = max(max_error, abs(value - analytic))
+        overshoot = max(overshoot, value - temperature)
+
+    return max_error, overshoot
+
+
+def time_scalar(step, n):
+    """
+    Seconds taken by n scalar model steps.
+
+    """
+
+    value = 0.0
+    start = time.perf_counter()
+    for i in range(n):
+        value = step(value, i * 60.0, 20.0, (i + 1) * 60.0, 0.1)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=2000000, help='events in the vectorized batch')
+    parser.add_argument('--twins', type=int, default=10000, help='twins the events are spread over')
+    parser.add_argument('--scalar-events', type=int, default=1000000, help='events stepped by the scalar loop')
+    args = parser.parse_args()
+
+    # accuracy of a 0 to 20 degree step for growing k*interval/60
+    k = 0.1
+    exact_ok = True
+    print('{:>10} {:>10}  {:>12} {:>12}  {:>12} {:>12}'.format(
+        'k*dt/60', 'interval', 'euler error', 'overshoot', 'exact error', 'overshoot'))
+    for ratio in (0.1, 0.5, 1.0, 1.5, 2.0, 3.0):
+        interval = ratio * 60 / k
+        euler_error, euler_overshoot = step_response(model.euler_step, k, interval)
+        exact_error, exact_overshoot = step_response(model.exact_step, k, interval)
+        exact_ok = exact_ok and exact_error < 1e-9
+        print('{:>10.1f} {:>9.0f}s  {:>12.3e} {:>12.3e}  {:>12.3e} {:>12.3e}'.format(
+            ratio, interval, euler_error, euler_overshoot, exact_error, exact_overshoot))
+
+    # scalar step speed
+    print()
+    for name in ('euler', 'exact'):
+        seconds = time_scalar(model.STEPS[name], args.scalar_events)
+        print('scalar     {:<6} {:>10} events  {:8.3f} s  {:8.3f} M events/s'.format(
+            name, args.scalar_events, seconds, args.scalar_events / seconds / 1e6))
+
+    # vectorized speed
+    events = synthesize(args.events, args.twins)
+    for name in ('euler', 'exact'):
+        start = time.perf_counter()
+        model.integrate_events(*events, exact=(name == 'exact'))
+        seconds = time.perf_counter() - start
+        print('vectorized {:<6} {:>10} events  {:8.3f} s  {:8.3f} M events/s'.format(
+            name, args.events, seconds, args.events / seconds / 1e6))
+
+    sys.exit(0 if exact_ok else 1)
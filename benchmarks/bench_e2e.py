@@ -0,0 +1,141 @@
+"""
+End-to-end benchmark of the function against the local fake DT server.
+Starts benchmarks/fake_dt.py in process, sends signed temperature events
+for every sensor of the project through main.main and reports throughput,
+latency percentiles and the calls the server received.
+
+Usage
+-----
+python benchmarks/bench_e2e.py [--devices N] [--events N] [--workers N] [--latency S] [--error-rate P]
+
+"""
+
+# packages
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+import statistics
+import concurrent.futures
+
+# project
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fake_dt
+import loadgen
+
+# signature secret shared by the benchmark and the function
+SECRET = 'benchmark-secret'
+
+
+class SignedRequest:
+    """
+    Request as sent by a Data Connector, signed with SECRET.
+    Offers the request interface used by main.main.
+
+    """
+
+    def __init__(self, body, secret=SECRET):
+        self.body    = json.dumps(body).encode()
+        self.headers = {'x-dt-signature': loadgen.sign(self.body, secret)}
+
+    def get_data(self):
+        return self.body
+
+    def get_json(self):
+        return json.loads(self.body)
+
+
+def temperature_event(project_id, device_id, labels, value, unixtime):
+    """
+    Data Connector body of a temperature event.
+
+    """
+
+    update_time = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(unixtime)) + '.000000Z'
+    return {
+        'event': {
+            'eventId':    os.urandom(10).hex(),
+            'targetName': 'projects/{}/devices/{}'.format(project_id, device_id),
+            'eventType':  'temperature',
+            'data':       {'temperature': {'value': value, 'updateTime': update_time}},
+            'timestamp':  update_time,
+        },
+        'labels': labels,
+    }
+
+
+def percentiles(samples):
+    """
+    Median, 95th and 99th percentile of samples.
+
+    """
+
+    if len(samples) < 2:
+        return samples * 3
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=100, help='sensors in the project')
+    parser.add_argument('--events', type=int, default=2000, help='events sent, spread round robin over the sensors')
+    parser.add_argument('--workers', type=int, default=1, help='concurrent invocations')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every server response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random seconds added on top')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of server requests answered with 503')
+    args = parser.parse_args()
+
+    # fake server with one populated project
+    project_id = 'benchmark'
+    dt = fake_dt.FakeDT(args.latency, args.jitter, args.error_rate)
+    device_ids = dt.populate(project_id, args.devices)
+    server = fake_dt.serve(dt)
+    base = 'http://{}:{}'.format(*server.server_address)
+
+    # configure the function before importing it
+    os.environ.update({
+        'API_URL_BASE':            base + '/v2',
+        'EMU_URL_BASE':            base + '/v2',
+        'AUTH_ENDPOINT':           base + '/oauth2/token',
+        'DT_SIGNATURE_SECRET':     SECRET,
+        'SERVICE_ACCOUNT_EMAIL':   'benchmark@example.com',
+        'SERVICE_ACCOUNT_KEY_ID':  'benchmark',
+        'SERVICE_ACCOUNT_SERCRET': 'benchmark',
+        'TRACE_JSON':              '0',
+    })
+    import main
+
+    # signed requests, built up front so signing is not measured
+    rng = random.Random(0)
+    start_ux = int(time.time()) - args.events * 60
+    requests = []
+    for i in range(args.events):
+        device_id = device_ids[i % args.devices]
+        labels = dt.projects[project_id][device_id]['labels']
+        body = temperature_event(project_id, device_id, labels, round(rng.gauss(20, 5), 2), start_ux + i * 60)
+        requests.append(SignedRequest(body))
+
+    def invoke(request):
+        begin = time.perf_counter()
+        status = main.main(request)
+        return time.perf_counter() - begin, status[1]
+
+    # run, discarding the function's console output
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        begin = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(invoke, requests))
+        wall = time.perf_counter() - begin
+
+    latencies = [seconds * 1000 for seconds, _ in results]
+    errors = sum(1 for _, code in results if code != 200)
+    p50, p95, p99 = percentiles(latencies)
+    print('events     {:>10}  errors {}  workers {}'.format(len(results), errors, args.workers))
+    print('throughput {:>10.1f} events/s'.format(len(results) / wall))
+    print('latency ms  p50 {:.3f}  p95 {:.3f}  p99 {:.3f}  max {:.3f}'.format(p50, p95, p99, max(latencies)))
+    print('server calls {}'.format(json.dumps(dict(sorted(dt.calls.items())))))
+    server.shutdown()
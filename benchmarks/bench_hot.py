@@ -0,0 +1,182 @@
+"""
+Micro-benchmarks of the helpers on the per-event hot path.
+Times device name and twin lookups, timestamp conversion, signature
+validation and the model step over project sizes from 10 to 100k devices,
+and compares the results against stored baselines. The run fails if any
+case is slower than its baseline by more than the threshold.
+
+Baselines depend on the machine, save them once on the machine the suite
+runs on before comparing against them.
+
+Usage
+-----
+python benchmarks/bench_hot.py [--sizes N ...] [--save] [--baseline PATH] [--threshold F]
+
+"""
+
+# packages
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import contextlib
+
+# project
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DT_SIGNATURE_SECRET', 'benchmark-secret-of-32-characters')
+import main
+import loadgen
+import helpers.general      as gen
+import helpers.registry     as reg
+import helpers.authenticate as auth
+
+# default baseline file and allowed slowdown
+BASELINE  = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+THRESHOLD = 0.25
+SIZES     = (10, 100, 1000, 10000, 100000)
+
+
+def synthesize_project(n_devices, twin_ratio=0.1):
+    """
+    Device list of a project with n_devices sensors, a fraction of them
+    with an emulated twin.
+
+    Returns
+    -------
+    devices : list
+        Sensor and twin dictionaries as listed by the API.
+    target_id : str
+        Identifier of the last sensor with a twin, the worst case for scans.
+
+    """
+
+    devices = []
+    target_id = None
+    n_twins = max(1, int(n_devices * twin_ratio))
+    for i in range(n_devices):
+        device_id = 'dev{:06d}'.format(i)
+        devices.append({
+            'name':   'projects/benchmark/devices/{}'.format(device_id),
+            'type':   'temperature',
+            'labels': {'name': 'Sensor {}'.format(i), main.EMULATION_LABEL: '0.1'},
+        })
+        if i >= n_devices - n_twins:
+            target_id = device_id
+            devices.append({
+                'name':     'projects/benchmark/devices/emu{:06d}'.format(i),
+                'type':     'temperature',
+                'labels':   {'name': 'Sensor {} twin'.format(i), main.ORIGINAL_DEVICE_LABEL: device_id},
+                'reported': {'temperature': {'value': 20.0, 'updateTime': '2020-10-01T12:00:00.000000Z'}},
+            })
+
+    return devices, target_id
+
+
+class SignedRequest:
+    """
+    Signed Data Connector request, as validated by project_validate.
+
+    """
+
+    def __init__(self, body):
+        self.body    = json.dumps(body).encode()
+        self.headers = {main.DT_SIGNATURE_HEADER: loadgen.sign(self.body, os.environ['DT_SIGNATURE_SECRET'])}
+
+    def get_data(self):
+        return self.body
+
+
+def cases(sizes):
+    """
+    Benchmark cases by name, each a callable timed per call.
+
+    """
+
+    update_time = '2020-10-01T12:01:00.123456789Z'
+    event = {
+        'eventType':  'temperature',
+        'targetName': 'projects/benchmark/devices/dev000000',
+        'data':       {'temperature': {'value': 21.5, 'updateTime': update_time}},
+    }
+    request = SignedRequest({'event': event, 'labels': {'name': 'Sensor 0', main.EMULATION_LABEL: '0.1'}})
+    devices, _ = synthesize_project(1)
+    twin = devices[-1]
+
+    found = {
+        'get_device_name':              lambda: main.get_device_name(twin),
+        'convert_event_data_timestamp': lambda: gen.convert_event_data_timestamp(update_time),
+        'project_validate':             lambda: auth.project_validate(request, main.DT_SIGNATURE_HEADER,
+                                                                      os.environ['DT_SIGNATURE_SECRET']),
+        'model_emulated_twin':          lambda: main.model_emulated_twin(event, twin, 0.1),
+    }
+
+    # lookups over the device index and a plain device list
+    for size in sizes:
+        devices, target_id = synthesize_project(size)
+        index = reg.build_index(devices)
+        found['find_twin[index,{}]'.format(size)] = lambda t=target_id, i=index: main.find_twin(t, i)
+        found['find_twin[list,{}]'.format(size)] = lambda t=target_id, d=devices: main.find_twin(t, d)
+        found['find_original_device[index,{}]'.format(size)] = lambda t=target_id, i=index: main.find_original_device(t, i)
+        found['find_original_device[list,{}]'.format(size)] = lambda t=target_id, d=devices: main.find_original_device(t, d)
+
+    return found
+
+
+def measure(func, repeat=5):
+    """
+    Best of repeat runs, in microseconds per call.
+    Console output of the function, like lookup logging, is discarded.
+
+    """
+
+    timer = timeit.Timer(func)
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number))
+
+    return best / number * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='project sizes in devices')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the best is kept')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='allowed slowdown against the baseline, 0.25 is 25%%')
+    parser.add_argument('--save', action='store_true', help='save the results as baseline instead of comparing')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    regressions = []
+    for name, func in cases(args.sizes).items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(func, args.repeat)
+        line = '{:<40} {:>12.3f} us'.format(name, results[name])
+        if name in baseline:
+            ratio = results[name] / baseline[name]
+            line += '  {:>6.2f}x baseline'.format(ratio)
+            if ratio > 1 + args.threshold:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'saved': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                       'python': sys.version.split()[0], 'results': results}, f, indent=2, sort_keys=True)
+        print('saved baseline to {}'.format(args.baseline))
+    elif not baseline:
+        print('no baseline at {}, save one with --save'.format(args.baseline))
+
+    if regressions:
+        print('{} case(s) slower than baseline by more than {:.0%}'.format(len(regressions), args.threshold))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,82 @@
+"""
+Cold-start benchmark of the function module.
+Imports main in fresh interpreters and reports the wall time of the import
+and the resident memory it adds, so import-time regressions are caught.
+
+Usage
+-----
+python benchmarks/bench_import.py [--runs N] [--max-ms MS] [--max-rss-mb MB]
+
+"""
+
+# packages
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# project root, imported from the child interpreters
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# executed in a fresh interpreter per run
+CHILD = '''
+import sys, json, time, resource
+sys.path.insert(0, {root!r})
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+import main
+wall = time.perf_counter() - start
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = sorted(m for m in ('jwt', 'requests', 'numpy', 'pandas') if m in sys.modules)
+print(json.dumps({{'wall': wall, 'rss_kb': rss_after, 'rss_delta_kb': rss_after - rss_before, 'heavy': heavy}}))
+'''
+
+
+def measure(runs):
+    """
+    Import main in runs fresh interpreters.
+
+    Returns
+    -------
+    results : list
+        One dictionary per run with wall time, peak RSS and loaded heavy modules.
+
+    """
+
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT)],
+                             cwd=ROOT, check=True, capture_output=True, text=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters to start')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if median import time exceeds this')
+    parser.add_argument('--max-rss-mb', type=float, default=None, help='fail if median peak RSS exceeds this')
+    args = parser.parse_args()
+
+    results  = measure(args.runs)
+    wall_ms  = statistics.median(r['wall'] for r in results) * 1000
+    rss_mb   = statistics.median(r['rss_kb'] for r in results) / 1024
+    delta_mb = statistics.median(r['rss_delta_kb'] for r in results) / 1024
+
+    print('import main  median {:.1f} ms  min {:.1f} ms  max {:.1f} ms'.format(
+        wall_ms, min(r['wall'] for r in results) * 1000, max(r['wall'] for r in results) * 1000))
+    print('peak rss     {:.1f} MB  (+{:.1f} MB from import)'.format(rss_mb, delta_mb))
+    print('heavy modules loaded at import: {}'.format(', '.join(results[0]['heavy']) or 'none'))
+
+    # regression gates
+    failed = False
+    if args.max_ms != None and wall_ms > args.max_ms:
+        print('FAIL: import time {:.1f} ms above {:.1f} ms'.format(wall_ms, args.max_ms))
+        failed = True
+    if args.max_rss_mb != None and rss_mb > args.max_rss_mb:
+        print('FAIL: peak rss {:.1f} MB above {:.1f} MB'.format(rss_mb, args.max_rss_mb))
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,101 @@
+"""
+Benchmark of the vectorized inertia model kernel.
+Runs helpers.model.integrate_events over synthetic event batches and
+compares speed and values against stepping helpers.model.euler_step event
+by event. Requires numpy.
+
+Usage
+-----
+python benchmarks/bench_model.py [--events N] [--twins N] [--scalar-events N]
+
+"""
+
+# packages
+import os
+import sys
+import time
+import argparse
+
+# project
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import helpers.model as model
+
+
+def synthesize(n_events, n_twins, seed=0):
+    """
+    Generate a batch of events with 1-10 minute reporting intervals.
+
+    Returns
+    -------
+    unixtimes, temperatures, coefficients, twin_ids : numpy.ndarray
+        Event arrays as taken by integrate_events.
+
+    """
+
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    twin_ids     = rng.integers(0, n_twins, n_events)
+    unixtimes    = 1.6e9 + np.cumsum(rng.integers(60, 600, n_events) / max(1, n_twins))
+    temperatures = rng.normal(20, 5, n_events)
+    coefficients = rng.uniform(0.01, 0.2, n_events)
+
+    return unixtimes, temperatures, coefficients, twin_ids
+
+
+def scalar_reference(unixtimes, temperatures, coefficients, twin_ids):
+    """
+    Step the model event by event as the request handler does.
+
+    Returns
+    -------
+    values : list
+        Modeled temperature after each event.
+
+    """
+
+    state  = {}
+    values = []
+    for ux, temperature, k, twin_id in zip(unixtimes.tolist(), temperatures.tolist(),
+                                           coefficients.tolist(), twin_ids.tolist()):
+        if twin_id in state:
+            value = model.euler_step(state[twin_id][0], state[twin_id][1], temperature, ux, k)
+        else:
+            value = temperature
+        state[twin_id] = (value, ux)
+        values.append(value)
+
+    return values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=2000000, help='events in the vectorized batch')
+    parser.add_argument('--twins', type=int, default=10000, help='twins the events are spread over')
+    parser.add_argument('--scalar-events', type=int, default=200000, help='events stepped by the scalar loop')
+    args = parser.parse_args()
+
+    import numpy as np
+
+    events = synthesize(args.events, args.twins)
+
+    # vectorized pass over the full batch
+    start = time.perf_counter()
+    values, _ = model.integrate_events(*events)
+    vector_s = time.perf_counter() - start
+    print('vectorized {:>10} events  {:8.3f} s  {:8.3f} M events/s'.format(
+        args.events, vector_s, args.events / vector_s / 1e6))
+
+    # scalar loop over a prefix, values must match the vectorized prefix
+    n = min(args.scalar_events, args.events)
+    prefix = [array[:n] for array in events]
+    start = time.perf_counter()
+    reference = scalar_reference(*prefix)
+    scalar_s = time.perf_counter() - start
+    print('scalar     {:>10} events  {:8.3f} s  {:8.3f} M events/s'.format(n, scalar_s, n / scalar_s / 1e6))
+    print('speedup    {:.1f}x'.format((scalar_s / n) / (vector_s / args.events)))
+
+    prefix_values, _ = model.integrate_events(*prefix)
+    error = np.max(np.abs(prefix_values - np.asarray(reference)))
+    print('max abs difference {:.3e}'.format(error))
+    sys.exit(0 if np.allclose(prefix_values, reference, rtol=1e-9, atol=1e-9) else 1)
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of event data timestamp conversion.
+Compares helpers.general.convert_event_data_timestamp against the previous
+pandas based implementation, which is only run if pandas is installed.
+
+Usage
+-----
+python benchmarks/bench_timestamp.py [--number N]
+
+"""
+
+# packages
+import os
+import sys
+import timeit
+import argparse
+import importlib.util
+
+# project
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import helpers.general as gen
+
+# typical event data timestamp
+TIMESTAMP = '2020-10-19T12:34:56.123456789Z'
+
+
+def pandas_convert_event_data_timestamp(ts):
+    """
+    Previous pandas based conversion, kept as reference.
+
+    """
+
+    import numpy  as np
+    import pandas as pd
+
+    timestamp = pd.to_datetime(ts)
+    unixtime  = pd.to_datetime(np.array([ts])).astype(int)[0] // 10**9
+
+    return timestamp, unixtime
+
+
+def bench(name, func, number):
+    """
+    Time func on TIMESTAMP and print the per-call cost.
+
+    Returns
+    -------
+    per_call : float
+        Best of five repeats in seconds per call.
+
+    """
+
+    per_call = min(timeit.repeat(lambda: func(TIMESTAMP), number=number, repeat=5)) / number
+    print('{:<10} {:>10.2f} us/call'.format(name, per_call * 1e6))
+    return per_call
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000, help='calls per repeat')
+    args = parser.parse_args()
+
+    fast = bench('rfc3339', gen.convert_event_data_timestamp, args.number)
+
+    if importlib.util.find_spec('pandas') == None:
+        print('pandas not installed, skipping reference implementation')
+        sys.exit(0)
+
+    # verify same unixtime before comparing
+    assert pandas_convert_event_data_timestamp(TIMESTAMP)[1] == gen.convert_event_data_timestamp(TIMESTAMP)[1]
+    slow = bench('pandas', pandas_convert_event_data_timestamp, max(1, args.number // 20))
+    print('speedup    {:>10.1f}x'.format(slow / fast))
@@ -0,0 +1,288 @@
+"""
+Local stand-in for the DT REST API, emulator and token endpoint.
+Implements the subset of calls made by the function, keeps projects in
+memory and adds configurable latency and error rate, so the function can be
+measured end to end without live endpoints.
+
+Point API_URL_BASE, EMU_URL_BASE and AUTH_ENDPOINT at the server, e.g.
+http://127.0.0.1:8080/v2 and http://127.0.0.1:8080/oauth2/token.
+
+Usage
+-----
+python benchmarks/fake_dt.py [--port N] [--devices N] [--latency S] [--jitter S] [--error-rate P]
+
+"""
+
+# packages
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# device labels, as used by the function
+EMULATION_LABEL       = 'inertia-model'
+ORIGINAL_DEVICE_LABEL = 'original_device_id'
+
+
+class FakeDT:
+    """
+    In-memory projects with the latency and error settings of the server.
+
+    Parameters
+    ----------
+    latency : float
+        Seconds added to every response.
+    jitter : float
+        Maximum seconds of uniform random latency added on top.
+    error_rate : float
+        Fraction of requests answered with 503, tokens excluded.
+    seed : int
+        Seed of the latency and error draws.
+
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency    = latency
+        self.jitter     = jitter
+        self.error_rate = error_rate
+        self.random     = random.Random(seed)
+        self.projects   = {}
+        self.calls      = {}
+        self.lock       = threading.RLock()
+
+    def add_device(self, project_id, device_id, labels, reported=None):
+        device = {
+            'name':     'projects/{}/devices/{}'.format(project_id, device_id),
+            'type':     'temperature',
+            'labels':   dict(labels),
+            'reported': reported or {'temperature': None},
+        }
+        with self.lock:
+            self.projects.setdefault(project_id, {})[device_id] = device
+        return device
+
+    def populate(self, project_id, n_devices, emulated=1.0, coefficient=0.1):
+        """
+        Add n_devices sensors, the first emulated fraction labelled for emulation.
+
+        Returns
+        -------
+        device_ids : list
+            Identifiers of the added sensors.
+
+        """
+
+        device_ids = []
+        for i in range(n_devices):
+            labels = {'name': 'Sensor {}'.format(i)}
+            if i < emulated * n_devices:
+                labels[EMULATION_LABEL] = str(coefficient)
+            device_ids.append('dev{:06d}'.format(i))
+            self.add_device(project_id, device_ids[-1], labels)
+
+        return device_ids
+
+    def delay(self):
+        # latency and injected failure of one request
+        with self.lock:
+            seconds = self.latency + self.random.uniform(0, self.jitter)
+            failed  = self.random.random() < self.error_rate
+        if seconds > 0:
+            time.sleep(seconds)
+        return failed
+
+    def count(self, call):
+        with self.lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Routes requests of the function to the FakeDT of the server.
+    Any path prefix before /projects, like /v2, is accepted.
+
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # answer without waiting on delayed acks of kept alive connections
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, obj, headers=None):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def route(self, method):
+        dt = self.server.dt
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        data = self.body() if method in ('POST', 'PATCH') else b''
+
+        # token endpoint
+        if method == 'POST' and url.path.endswith('/token'):
+            dt.count('token')
+            return self.reply(200, {'access_token': uuid.uuid4().hex, 'token_type': 'bearer', 'expires_in': 3600})
+
+        # everything else lives below /projects/<project>/devices
+        parts = url.path.strip('/').split('/')
+        if 'projects' not in parts:
+            return self.reply(404, {'error': 'not found'})
+        parts = parts[parts.index('projects'):]
+        if len(parts) < 3 or parts[2] != 'devices':
+            return self.reply(404, {'error': 'not found'})
+        project_id = parts[1]
+
+        if dt.delay():
+            dt.count('error')
+            return self.reply(503, {'error': 'injected failure'}, {'Retry-After': '0'})
+
+        with dt.lock:
+            devices = dt.projects.setdefault(project_id, {})
+
+            # list, with label filters and paging, counted apart from full scans
+            if method == 'GET' and len(parts) == 3:
+                dt.count('list_filtered' if 'labelFilters' in query else 'list')
+                listed = list(devices.values())
+                for label_filter in query.get('labelFilters', []):
+                    key, _, value = label_filter.partition('=')
+                    listed = [d for d in listed if d['labels'].get(key) == value]
+                page_size = int(query.get('pageSize', ['100'])[0])
+                start = int(query.get('pageToken', ['0'])[0] or 0)
+                token = str(start + page_size) if start + page_size < len(listed) else ''
+                return self.reply(200, {'devices': listed[start:start + page_size], 'nextPageToken': token})
+
+            # create emulated device
+            if method == 'POST' and len(parts) == 3:
+                dt.count('create')
+                device_id = 'emu' + uuid.uuid4().hex[:17]
+                labels = json.loads(data).get('labels', {})
+                devices[device_id] = {
+                    'name':     'projects/{}/devices/{}'.format(project_id, device_id),
+                    'type':     'temperature',
+                    'labels':   labels,
+                    'reported': {'temperature': None},
+                }
+                return self.reply(200, devices[device_id])
+
+            device_id, _, action = parts[3].partition(':')
+            if device_id not in devices:
+                return self.reply(404, {'error': 'device not found'})
+            device = devices[device_id]
+
+            # publish emulated event
+            if method == 'POST' and action == 'publish':
+                dt.count('publish')
+                value = json.loads(data)['temperature']['value']
+                update_time = time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime())
+                device['reported'] = {'temperature': {'value': value, 'updateTime': update_time}}
+                return self.reply(200, {})
+
+            # get and delete device
+            if method == 'GET' and len(parts) == 4:
+                dt.count('get')
+                return self.reply(200, device)
+            if method == 'DELETE' and len(parts) == 4:
+                dt.count('delete')
+                del devices[device_id]
+                return self.reply(200, {})
+
+            # patch label value
+            if method == 'PATCH' and len(parts) == 6 and parts[4] == 'labels':
+                dt.count('label')
+                device['labels'][parts[5]] = json.loads(data)['value']
+                return self.reply(200, {'key': parts[5], 'value': device['labels'][parts[5]]})
+
+        return self.reply(404, {'error': 'not found'})
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PATCH(self):
+        self.route('PATCH')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+
+class Server(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a listen backlog deep enough for concurrent
+    benchmark clients. The default of 5 drops connection attempts, which
+    are retried after a second and inflate tail latency.
+
+    """
+
+    request_queue_size = 128
+    daemon_threads     = True
+
+
+def serve(dt, host='127.0.0.1', port=0, background=True):
+    """
+    Serve a FakeDT over HTTP.
+
+    Parameters
+    ----------
+    dt : FakeDT
+        State and settings to serve.
+    host : str
+        Interface to bind.
+    port : int
+        Port to bind, 0 picks a free one.
+    background : bool
+        Serve from a daemon thread and return, or block.
+
+    Returns
+    -------
+    server : Server
+        Running server, its address in server.server_address.
+
+    """
+
+    server = Server((host, port), Handler)
+    server.dt = dt
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='interface to bind')
+    parser.add_argument('--port', type=int, default=8080, help='port to bind')
+    parser.add_argument('--project', default='project', help='identifier of the populated project')
+    parser.add_argument('--devices', type=int, default=100, help='sensors in the project')
+    parser.add_argument('--emulated', type=float, default=1.0, help='fraction of sensors labelled for emulation')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random seconds added on top')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    dt = FakeDT(args.latency, args.jitter, args.error_rate)
+    dt.populate(args.project, args.devices, args.emulated)
+    print('serving project {} with {} devices on http://{}:{}/v2'.format(args.project, args.devices, args.host, args.port))
+    serve(dt, args.host, args.port, background=False)
@@ -0,0 +1,261 @@
+"""
+Load generator posing as a DT Studio Data Connector.
+Synthesizes temperature and labelsChanged events for a number of sensors,
+signs each body like a Data Connector, with an HS256 JWT over the SHA-1
+checksum of the body, and posts them to the function.
+
+In open-loop mode events are scheduled at the target rate regardless of
+responses, and latency is measured from the scheduled send time, so a
+slow function shows up as queueing instead of a lower offered rate. In
+closed-loop mode a fixed number of clients send their next event as soon
+as the previous one was answered.
+
+Usage
+-----
+python benchmarks/loadgen.py URL [--mode open|closed] [--rate N] [--concurrency N] [--duration S] [--devices N]
+
+"""
+
+# packages
+import os
+import sys
+import hmac
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+import statistics
+import concurrent.futures
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+# JWT header of every signature
+JWT_HEADER = b64url(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode())
+
+
+def sign(body, secret):
+    """
+    Signature of a body as sent in the x-dt-signature header.
+
+    Parameters
+    ----------
+    body : bytes
+        Request body.
+    secret : str
+        Signature secret of the Data Connector.
+
+    Returns
+    -------
+    token : str
+        HS256 JWT with the SHA-1 checksum of body.
+
+    """
+
+    payload = b64url(json.dumps({'checksum': hashlib.sha1(body).hexdigest()}, separators=(',', ':')).encode())
+    signing_input = JWT_HEADER + b'.' + payload
+    signature = b64url(hmac.new(secret.encode(), signing_input, hashlib.sha256).digest())
+    return (signing_input + b'.' + signature).decode()
+
+
+class EventSource:
+    """
+    Thread-safe stream of Data Connector bodies for a set of sensors.
+    Temperatures follow a random walk per sensor and a fraction of the
+    events rename the sensor instead.
+
+    Parameters
+    ----------
+    project_id : str
+        Project of the sensors.
+    n_devices : int
+        Number of sensors.
+    labels_ratio : float
+        Fraction of labelsChanged events.
+    coefficient : float
+        Value of the emulation label of every sensor.
+    seed : int
+        Seed of the random walk.
+
+    """
+
+    def __init__(self, project_id, n_devices, labels_ratio=0.0, coefficient=0.1, seed=0):
+        self.project_id   = project_id
+        self.labels_ratio = labels_ratio
+        self.random       = random.Random(seed)
+        self.lock         = threading.Lock()
+        self.sent         = 0
+        self.devices      = [{
+            'id':          'dev{:06d}'.format(i),
+            'temperature': 20.0,
+            'labels':      {'name': 'Sensor {}'.format(i), 'inertia-model': str(coefficient)},
+        } for i in range(n_devices)]
+
+    def next(self):
+        """
+        Body of the next event, round robin over the sensors.
+
+        """
+
+        with self.lock:
+            device = self.devices[self.sent % len(self.devices)]
+            self.sent += 1
+            now = time.time()
+            update_time = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + '.{:06d}Z'.format(int(now % 1 * 1e6))
+
+            if self.random.random() < self.labels_ratio:
+                device['labels'] = dict(device['labels'], name='Sensor {} {}'.format(device['id'], self.sent))
+                event_type = 'labelsChanged'
+                data = {'added': {}, 'modified': {'name': device['labels']['name']}, 'removed': []}
+            else:
+                device['temperature'] = round(device['temperature'] + self.random.gauss(0, 0.5), 2)
+                event_type = 'temperature'
+                data = {'temperature': {'value': device['temperature'], 'updateTime': update_time}}
+
+            return {
+                'event': {
+                    'eventId':    os.urandom(10).hex(),
+                    'targetName': 'projects/{}/devices/{}'.format(self.project_id, device['id']),
+                    'eventType':  event_type,
+                    'data':       data,
+                    'timestamp':  update_time,
+                },
+                'labels': dict(device['labels']),
+            }
+
+
+class Client:
+    """
+    Signs and posts events, recording latency and status per request.
+    Keeps one keep-alive session per thread.
+
+    """
+
+    def __init__(self, url, secret, timeout):
+        self.url     = url
+        self.secret  = secret
+        self.timeout = timeout
+        self.local   = threading.local()
+        self.results = []
+        self.lock    = threading.Lock()
+
+    def post(self, body, scheduled=None):
+        import requests
+
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+
+        data = json.dumps(body).encode()
+        headers = {'Content-Type': 'application/json', 'x-dt-signature': sign(data, self.secret)}
+        start = time.perf_counter()
+        try:
+            status = self.local.session.post(self.url, data=data, headers=headers, timeout=self.timeout).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        end = time.perf_counter()
+
+        with self.lock:
+            self.results.append((end - (scheduled or start), status))
+
+
+def open_loop(client, source, rate, duration, concurrency):
+    """
+    Send events at a fixed rate, latency counted from the scheduled time.
+
+    """
+
+    interval = 1 / rate
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        for i in range(int(rate * duration)):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(client.post, source.next(), scheduled)
+
+
+def closed_loop(client, source, duration, concurrency):
+    """
+    Keep concurrency clients sending back to back for duration seconds.
+
+    """
+
+    deadline = time.perf_counter() + duration
+
+    def run():
+        while time.perf_counter() < deadline:
+            client.post(source.next())
+
+    threads = [threading.Thread(target=run) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def report(results, wall):
+    """
+    Summary of the recorded requests.
+
+    Returns
+    -------
+    summary : dict
+        Request count, throughput, status counts and latency percentiles in ms.
+
+    """
+
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    summary = {'requests': len(results), 'throughput': len(results) / wall, 'statuses': statuses}
+    if len(latencies) >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        summary.update({'p50': cuts[49], 'p90': cuts[89], 'p95': cuts[94], 'p99': cuts[98], 'max': latencies[-1]})
+
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url', help='function URL')
+    parser.add_argument('--secret', default=os.environ.get('DT_SIGNATURE_SECRET'), help='signature secret, defaults to DT_SIGNATURE_SECRET')
+    parser.add_argument('--mode', choices=('open', 'closed'), default='open', help='open or closed loop')
+    parser.add_argument('--rate', type=float, default=50, help='events per second in open-loop mode')
+    parser.add_argument('--concurrency', type=int, default=16, help='clients in closed-loop mode, requests in flight in open-loop mode')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to send for')
+    parser.add_argument('--devices', type=int, default=100, help='sensors events are spread over')
+    parser.add_argument('--project', default='project', help='project of the sensors')
+    parser.add_argument('--labels-ratio', type=float, default=0.01, help='fraction of labelsChanged events')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a response')
+    parser.add_argument('--output', help='write the summary and raw latencies as JSON to this file')
+    args = parser.parse_args()
+
+    if args.secret == None:
+        sys.exit('a signature secret is required, see --secret')
+
+    client = Client(args.url, args.secret, args.timeout)
+    source = EventSource(args.project, args.devices, args.labels_ratio)
+
+    start = time.perf_counter()
+    if args.mode == 'open':
+        open_loop(client, source, args.rate, args.duration, args.concurrency)
+    else:
+        closed_loop(client, source, args.duration, args.concurrency)
+    summary = report(client.results, time.perf_counter() - start)
+
+    print('mode {}  requests {}  throughput {:.1f}/s'.format(args.mode, summary['requests'], summary['throughput']))
+    print('statuses {}'.format(json.dumps(summary['statuses'])))
+    if 'p50' in summary:
+        print('latency ms  p50 {p50:.1f}  p90 {p90:.1f}  p95 {p95:.1f}  p99 {p99:.1f}  max {max:.1f}'.format(**summary))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'summary': summary, 'latencies': [(seconds, str(status)) for seconds, status in client.results]}, f)
@@ -1,11 +1,173 @@
 # packages
-import jwt
+# jwt is imported where used to keep cold starts short
+import os
+import re
+import hmac
+import json
 import time
+import base64
 import hashlib
-import requests
+import threading
+import collections
 
+# project
+import helpers.session as http
+
+# access token cache
+# keyed on (email, key_id, auth_endpoint), reused across warm invocations
+# refreshes of one key are serialized so concurrent misses share a fetch
+TOKEN_LIFETIME       = 3600
+TOKEN_REFRESH_MARGIN = 300
+token_cache          = {}
+token_cache_stats    = {'hits': 0, 'misses': 0}
+token_locks          = {}
+token_locks_lock     = threading.Lock()
+
+# HMAC state keyed on signature secret, copied per verification
+hmac_keys = {}
+
+# JWT segments are unpadded base64url, RFC 7515
+B64URL_PATTERN = re.compile(rb'[A-Za-z0-9_-]*')
+
+# replay cache
+# body checksums of validated requests seen in the last REPLAY_TTL seconds,
+# at most REPLAY_CACHE_SIZE of them, 0 disables the cache
+REPLAY_CACHE_SIZE = int(os.environ.get('REPLAY_CACHE_SIZE', 10000))
+REPLAY_TTL        = float(os.environ.get('REPLAY_TTL', 300))
+replay_cache      = collections.OrderedDict()
+replay_lock       = threading.Lock()
+replay_stats      = {'duplicates': 0, 'in_progress': 0}
+
+
+def b64url_decode(segment):
+    # strict, unpadded url-safe alphabet only, anything else raises ValueError
+    if B64URL_PATTERN.fullmatch(segment) == None:
+        raise ValueError('invalid base64url segment')
+    return base64.urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+def verify_hs256(token, secret):
+    """
+    Verify an HS256 signed JWT and return its payload.
+    The HMAC key schedule of the secret is computed once and reused, and
+    signatures are compared in constant time.
+
+    Parameters
+    ----------
+    token : str
+        Compact serialized JWT.
+    secret : str
+        Password used to sign the token.
+
+    Returns
+    -------
+    payload : dict
+        Verified claims of the token.
+        Returns None if the token is malformed, not signed with HS256 by
+        secret, expired or not yet valid.
+
+    """
+
+    try:
+        header, payload, signature = token.encode('ascii').split(b'.')
+        if json.loads(b64url_decode(header)).get('alg') != 'HS256':
+            return None
+
+        if secret not in hmac_keys:
+            hmac_keys[secret] = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+        mac = hmac_keys[secret].copy()
+        mac.update(header + b'.' + payload)
+        if not hmac.compare_digest(mac.digest(), b64url_decode(signature)):
+            return None
+
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, TypeError, AttributeError, UnicodeError):
+        return None
+
+    # registered time claims, as checked by jwt.decode
+    if not isinstance(claims, dict):
+        return None
+    now = time.time()
+    try:
+        if 'exp' in claims and now >= float(claims['exp']):
+            return None
+        if 'nbf' in claims and now < float(claims['nbf']):
+            return None
+    except (ValueError, TypeError):
+        return None
+
+    return claims
+
+
+def claim_request(checksum):
+    """
+    Claim a validated request for processing, keyed on its body checksum.
+    A Data Connector re-delivering a request sends the same body, so a
+    checksum seen within REPLAY_TTL seconds marks a duplicate.
+
+    Parameters
+    ----------
+    checksum : str
+        Hex SHA-1 digest of the request body.
+
+    Returns
+    -------
+    state : str
+        None if the request was claimed and should be processed,
+        'done' for a duplicate of a processed request and
+        'pending' for a duplicate of a request still in progress.
+
+    """
+
+    if REPLAY_CACHE_SIZE <= 0:
+        return None
+
+    now = time.time()
+    with replay_lock:
+        # drop expired entries, oldest first
+        while replay_cache and next(iter(replay_cache.values()))[0] < now - REPLAY_TTL:
+            replay_cache.popitem(last=False)
+
+        if checksum in replay_cache:
+            state = replay_cache[checksum][1]
+            replay_stats['duplicates' if state == 'done' else 'in_progress'] += 1
+            return state
+
+        replay_cache[checksum] = (now, 'pending')
+        if len(replay_cache) > REPLAY_CACHE_SIZE:
+            replay_cache.popitem(last=False)
+
+    return None
+
+
+def settle_request(checksum, success):
+    """
+    Settle a request claimed by claim_request.
+    Successful requests stay in the cache as done, failed ones are released
+    so a retry of the Data Connector is processed again.
+
+    Parameters
+    ----------
+    checksum : str
+        Hex SHA-1 digest of the request body.
+    success : bool
+        Whether the request was processed successfully.
 
-def project_validate(request, header, secret):
+    """
+
+    if REPLAY_CACHE_SIZE <= 0:
+        return
+
+    with replay_lock:
+        if checksum not in replay_cache:
+            return
+        if success:
+            replay_cache[checksum] = (replay_cache[checksum][0], 'done')
+        else:
+            del replay_cache[checksum]
+
+
+def project_validate(request, header, secret, checksum=None):
     """
     Validate request content.
     Checks secret and checksum.
@@ -18,6 +180,9 @@ def project_validate(request, header, secret):
         Custom DT JWT header in request.
     secret : str
         Password used to sign request content.
+    checksum : str
+        Hex SHA-1 digest of the body if already computed, see helpers.body.read.
+        Computed from request.get_data() if not given.
 
     Returns
     -------
@@ -35,25 +200,24 @@ def project_validate(request, header, secret):
         return ('missing header', 400)
 
     # verify secret against environment variable
-    token = request.headers[header]
-    try:
-        payload = jwt.decode(token, secret, algorithms=["HS256"])
-    except:
+    payload = verify_hs256(request.headers[header], secret)
+    if payload == None or 'checksum' not in payload:
         return ('signature error', 400)
 
     # verify body checksum
-    m = hashlib.sha1()
-    m.update(request.get_data())
-    checksum = m.digest().hex()
+    if checksum == None:
+        m = hashlib.sha1()
+        m.update(request.get_data())
+        checksum = m.digest().hex()
 
-    if payload["checksum"] != checksum:
+    if not hmac.compare_digest(str(payload['checksum']).encode(), checksum.encode()):
         return ('checksum mismatch', 400)
 
     # success
     return ('OK', 200)
 
 
-def authenticate_service_account(email, key_id, secret, auth_endpoint):
+def request_service_account_token(email, key_id, secret, auth_endpoint):
     """
     Perform OAuth2 authentication flow for DT Authentication.
     Uses service accounts for access control.
@@ -75,17 +239,21 @@ def authenticate_service_account(email, key_id, secret, auth_endpoint):
     -------
     access_token : str
         Token used to authenticate future POST requests.
+        Returns None if authentication failed.
+    expires_in : int
+        Seconds until the token expires, as reported by the endpoint.
 
     """
 
     # create jwt
+    import jwt
     headers = {
         "alg": "HS256",
         "kid": key_id
     }
     payload = {
         "iat": int(time.time()),
-        "exp": int(time.time()) + 3600,
+        "exp": int(time.time()) + TOKEN_LIFETIME,
         "aud": auth_endpoint,
         "iss": email
     }
@@ -99,12 +267,115 @@ def authenticate_service_account(email, key_id, secret, auth_endpoint):
         'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer'
     }
 
-    response = requests.post(auth_endpoint, data=parameters).json()
+    response = http.post(auth_endpoint, data=parameters).json()
 
     try:
         access_token = 'Bearer ' + response['access_token']
     except KeyError:
-        return None
+        return None, 0
+
+    return access_token, int(response.get('expires_in', TOKEN_LIFETIME))
+
+
+def authenticate_service_account(email, key_id, secret, auth_endpoint):
+    """
+    Perform OAuth2 authentication flow for DT Authentication.
+    See request_service_account_token for details.
+
+    Parameters
+    ----------
+    email : str
+        Service account email.
+    key_id : str
+        Service account public key.
+    secret : str
+        Password used to sign request content.
+    auth_endpoint : str
+        Endpoint for authentication request.
+
+    Returns
+    -------
+    access_token : str
+        Token used to authenticate future POST requests.
+
+    """
+
+    access_token, _ = request_service_account_token(email, key_id, secret, auth_endpoint)
+    return access_token
+
+
+def cached_service_account_token(email, key_id, secret, auth_endpoint, margin=TOKEN_REFRESH_MARGIN):
+    """
+    Return a service account access token, reusing a cached one when possible.
+    A new token is fetched when none is cached or the cached one
+    expires within margin seconds.
+
+    Parameters
+    ----------
+    email : str
+        Service account email.
+    key_id : str
+        Service account public key.
+    secret : str
+        Password used to sign request content.
+    auth_endpoint : str
+        Endpoint for authentication request.
+    margin : int
+        Seconds before expiry at which the token is refreshed.
+
+    Returns
+    -------
+    access_token : str
+        Token used to authenticate future POST requests.
+        Returns None if authentication failed.
+
+    """
+
+    # reuse cached token if not about to expire
+    key = (email, key_id, auth_endpoint)
+    access_token = cached_token(key, margin)
+    if access_token != None:
+        return access_token
+
+    with token_locks_lock:
+        lock = token_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        # another thread may have refreshed while this one waited
+        access_token = cached_token(key, margin)
+        if access_token != None:
+            return access_token
+
+        # fetch a new token
+        token_cache_stats['misses'] += 1
+        issued_at = time.time()
+        access_token, expires_in = request_service_account_token(email, key_id, secret, auth_endpoint)
+
+        # only cache successful authentications
+        if access_token == None:
+            token_cache.pop(key, None)
+            return None
+        token_cache[key] = (access_token, issued_at + expires_in)
 
     return access_token
 
+
+def cached_token(key, margin):
+    # cached token of key if it does not expire within margin seconds
+    entry = token_cache.get(key)
+    if entry == None or time.time() >= entry[1] - margin:
+        return None
+
+    token_cache_stats['hits'] += 1
+    return entry[0]
+
+
+def clear_token_cache():
+    """
+    Drop all cached access tokens and reset the hit/miss counters.
+
+    """
+
+    token_cache.clear()
+    token_cache_stats['hits']   = 0
+    token_cache_stats['misses'] = 0
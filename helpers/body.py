@@ -0,0 +1,112 @@
+# packages
+# orjson is imported where used and optional, json is the fallback
+import os
+import json
+import hashlib
+
+# body configuration
+# larger bodies are rejected before they are read in full
+MAX_BODY_SIZE   = int(os.environ.get('MAX_BODY_SIZE', 10 * 1024 * 1024))
+BODY_CHUNK_SIZE = 64 * 1024
+
+# JSON parser, resolved on first use
+json_loads = None
+
+
+class BodyTooLarge(ValueError):
+    """
+    Raised when a request body exceeds the size limit.
+
+    """
+
+
+def read(request, limit=None):
+    """
+    Read the request body once, hashing it while it is read.
+    Streams the body in chunks if the request offers a stream, so large
+    batch bodies are hashed without a second pass and oversized bodies are
+    rejected early.
+
+    Parameters
+    ----------
+    request : object
+        HTTP POST request received, with headers and get_data(), and
+        optionally content_length and stream.
+    limit : int
+        Largest accepted body in bytes. Defaults to MAX_BODY_SIZE.
+
+    Returns
+    -------
+    data : bytes
+        Request body.
+    checksum : str
+        Hex SHA-1 digest of the body, as signed by the Data Connector.
+
+    Raises
+    ------
+    BodyTooLarge
+        If the body is larger than limit.
+
+    """
+
+    if limit == None:
+        limit = MAX_BODY_SIZE
+
+    # reject on the declared length first
+    length = getattr(request, 'content_length', None)
+    if length != None and length > limit:
+        raise BodyTooLarge('body of {} bytes exceeds {}'.format(length, limit))
+
+    m = hashlib.sha1()
+    stream = getattr(request, 'stream', None)
+    if stream == None:
+        data = request.get_data()
+        if len(data) > limit:
+            raise BodyTooLarge('body of {} bytes exceeds {}'.format(len(data), limit))
+        m.update(data)
+        return data, m.hexdigest()
+
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(BODY_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        if len(buffer) > limit:
+            raise BodyTooLarge('body exceeds {} bytes'.format(limit))
+        m.update(chunk)
+
+    return bytes(buffer), m.hexdigest()
+
+
+def parse(data):
+    """
+    Parse a JSON request body, with orjson if it is installed.
+
+    Parameters
+    ----------
+    data : bytes
+        Request body.
+
+    Returns
+    -------
+    body : object
+        Parsed body, a dict for single events and a list for batches.
+
+    Raises
+    ------
+    ValueError
+        If the body is not valid JSON.
+
+    """
+
+    global json_loads
+
+    if json_loads == None:
+        try:
+            import orjson
+            json_loads = orjson.loads
+        except ImportError:
+            json_loads = json.loads
+
+    return json_loads(data)
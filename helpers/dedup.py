@@ -0,0 +1,195 @@
+# packages
+# sqlite3 is imported where used, it is only needed by the sqlite store
+import os
+import time
+import threading
+import collections
+
+# deduplication configuration
+# identifiers of processed events are remembered for EVENT_DEDUP_TTL seconds,
+# memory keeps the last EVENT_DEDUP_SIZE per instance, sqlite persists to
+# EVENT_DEDUP_PATH and can be shared by processes on one host, none disables
+EVENT_DEDUP_STORE = os.environ.get('EVENT_DEDUP_STORE', 'memory')
+EVENT_DEDUP_PATH  = os.environ.get('EVENT_DEDUP_PATH', '/tmp/event_dedup')
+EVENT_DEDUP_SIZE  = int(os.environ.get('EVENT_DEDUP_SIZE', 100000))
+EVENT_DEDUP_TTL   = float(os.environ.get('EVENT_DEDUP_TTL', 3600))
+
+# default store, created on first use, and counters
+store       = None
+store_lock  = threading.Lock()
+dedup_stats = {'duplicates': 0, 'marked': 0}
+
+
+class MemoryStore:
+    """
+    In-memory least recently marked store of event identifiers.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of identifiers kept before the oldest is evicted.
+    ttl : float
+        Seconds an identifier is remembered.
+
+    """
+
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl      = ttl
+        self.entries  = collections.OrderedDict()
+        self.lock     = threading.Lock()
+
+    def seen(self, event_id):
+        with self.lock:
+            marked = self.entries.get(event_id)
+            if marked == None:
+                return False
+            if marked < time.time() - self.ttl:
+                del self.entries[event_id]
+                return False
+            return True
+
+    def mark(self, event_id):
+        with self.lock:
+            self.entries[event_id] = time.time()
+            self.entries.move_to_end(event_id)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+
+class SQLiteStore:
+    """
+    Event identifiers persisted in an SQLite database.
+    Expired rows are deleted every few hundred marks.
+
+    Parameters
+    ----------
+    path : str
+        Path of the database file.
+    ttl : float
+        Seconds an identifier is remembered.
+
+    """
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path, ttl):
+        import sqlite3
+        self.ttl = ttl
+        self.connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS seen_events (event_id TEXT PRIMARY KEY, marked REAL)'
+        )
+        self.marks = 0
+        self.lock  = threading.Lock()
+
+    def seen(self, event_id):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM seen_events WHERE event_id = ? AND marked >= ?', (event_id, time.time() - self.ttl)
+            ).fetchone()
+        return row != None
+
+    def mark(self, event_id):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO seen_events (event_id, marked) VALUES (?, ?)', (event_id, time.time())
+            )
+            self.marks += 1
+            if self.marks % self.PURGE_EVERY == 0:
+                self.connection.execute('DELETE FROM seen_events WHERE marked < ?', (time.time() - self.ttl,))
+
+
+def create_store(kind, path=EVENT_DEDUP_PATH, size=EVENT_DEDUP_SIZE, ttl=EVENT_DEDUP_TTL):
+    """
+    Create an event deduplication store.
+
+    Parameters
+    ----------
+    kind : str
+        One of 'memory', 'sqlite' or 'none'.
+    path : str
+        Backing file of the sqlite store.
+    size : int
+        Capacity of the memory store.
+    ttl : float
+        Seconds an identifier is remembered.
+
+    Returns
+    -------
+    store : object
+        Store with seen(event_id) and mark(event_id) methods.
+        Returns None if deduplication is disabled.
+
+    """
+
+    if kind == 'memory':
+        return MemoryStore(size, ttl)
+    if kind == 'sqlite':
+        return SQLiteStore(path, ttl)
+    if kind == 'none':
+        return None
+    raise ValueError('unknown event dedup store: {}'.format(kind))
+
+
+def get_store():
+    """
+    Return the default store configured by EVENT_DEDUP_STORE.
+
+    """
+
+    global store
+
+    if store == None and EVENT_DEDUP_STORE != 'none':
+        with store_lock:
+            if store == None:
+                store = create_store(EVENT_DEDUP_STORE)
+
+    return store
+
+
+def seen(event_id):
+    """
+    Check whether an event was already processed.
+
+    Parameters
+    ----------
+    event_id : str
+        Identifier of the event, None for events without one.
+
+    Returns
+    -------
+    duplicate : bool
+        True if the event was marked within EVENT_DEDUP_TTL seconds.
+
+    """
+
+    s = get_store()
+    if s == None or event_id == None:
+        return False
+
+    if s.seen(event_id):
+        dedup_stats['duplicates'] += 1
+        return True
+
+    return False
+
+
+def mark(event_id):
+    """
+    Remember an event as processed.
+
+    Parameters
+    ----------
+    event_id : str
+        Identifier of the event, None for events without one.
+
+    """
+
+    s = get_store()
+    if s == None or event_id == None:
+        return
+
+    s.mark(event_id)
+    dedup_stats['marked'] += 1
@@ -0,0 +1,185 @@
+# packages
+import os
+import time
+import threading
+
+# coalescing configuration
+# the first value of a twin is published at once and opens a window, values
+# arriving within the window are folded and only the last one is published
+# when it closes, 0 disables coalescing
+EMIT_COALESCE_WINDOW = float(os.environ.get('EMIT_COALESCE_WINDOW', 0))
+
+# emission policy defaults, overridden per twin by device labels
+# values within EMIT_DEADBAND degrees of the last sent one, or less than
+# EMIT_MIN_INTERVAL seconds of event time after it, are not published
+EMIT_DEADBAND     = float(os.environ.get('EMIT_DEADBAND', 0))
+EMIT_MIN_INTERVAL = float(os.environ.get('EMIT_MIN_INTERVAL', 0))
+
+# open windows and last sent (value, unixtime) per twin and emit counters,
+# reused across warm invocations
+windows      = {}
+windows_lock = threading.Lock()
+last_sent    = {}
+emit_stats   = {'sent': 0, 'suppressed': 0, 'coalesced': 0, 'flushed': 0}
+
+
+def admit(twin_id, value, unixtime, deadband=None, min_interval=None):
+    """
+    Decide whether a modeled value of a twin passes its emission policy.
+    The first value of a twin always passes.
+
+    Parameters
+    ----------
+    twin_id : str
+        Identifier of emulated twin.
+    value : float
+        Modeled temperature value.
+    unixtime : float
+        Unixtime of the event the value was modeled from.
+    deadband : float
+        Smallest change from the last sent value that is published.
+        Defaults to EMIT_DEADBAND.
+    min_interval : float
+        Smallest number of seconds after the last sent value that is published.
+        Defaults to EMIT_MIN_INTERVAL.
+
+    Returns
+    -------
+    publish : bool
+        True if value should be published, False if it is suppressed.
+
+    """
+
+    if deadband == None:
+        deadband = EMIT_DEADBAND
+    if min_interval == None:
+        min_interval = EMIT_MIN_INTERVAL
+
+    # each test only applies with a positive threshold
+    previous = last_sent.get(twin_id)
+    if previous != None:
+        if (deadband > 0 and abs(value - previous[0]) < deadband) \
+                or (min_interval > 0 and unixtime - previous[1] < min_interval):
+            emit_stats['suppressed'] += 1
+            return False
+
+    return True
+
+
+def mark_sent(twin_id, value, unixtime):
+    """
+    Remember a value as the last one sent to a twin, for the emission policy.
+    Values folded into a coalescing window are marked too, publishes are
+    counted separately by count_sent.
+
+    Parameters
+    ----------
+    twin_id : str
+        Identifier of emulated twin.
+    value : float
+        Published temperature value.
+    unixtime : float
+        Unixtime of the event the value was modeled from.
+
+    """
+
+    last_sent[twin_id] = (value, unixtime)
+
+
+def count_sent():
+    """
+    Count a value published to a twin, directly or from a closed window.
+
+    """
+
+    emit_stats['sent'] += 1
+
+
+def submit(twin_id, value, emit, window=None):
+    """
+    Offer a modeled value of a twin for publishing.
+
+    Parameters
+    ----------
+    twin_id : str
+        Identifier of emulated twin.
+    value : float
+        Modeled temperature value.
+    emit : callable
+        Publishes a value to the twin when called with it, used for values
+        held back until their window closes.
+    window : float
+        Seconds of the coalescing window. Defaults to EMIT_COALESCE_WINDOW.
+
+    Returns
+    -------
+    publish : bool
+        True if the caller should publish value now,
+        False if it was held back in an open window.
+
+    """
+
+    if window == None:
+        window = EMIT_COALESCE_WINDOW
+
+    with windows_lock:
+        # fold into open window
+        if twin_id in windows:
+            windows[twin_id]['value'] = value
+            windows[twin_id]['emit']  = emit
+            emit_stats['coalesced'] += 1
+            return False
+
+        # open a new window, closed by a timer or the next flush
+        timer = threading.Timer(window, close_window, args=(twin_id,))
+        timer.daemon = True
+        windows[twin_id] = {'opened': time.time(), 'window': window, 'value': None, 'emit': None, 'timer': timer}
+
+    timer.start()
+    return True
+
+
+def close_window(twin_id):
+    """
+    Close the window of a twin and publish the last value held back in it.
+
+    Parameters
+    ----------
+    twin_id : str
+        Identifier of emulated twin.
+
+    """
+
+    with windows_lock:
+        entry = windows.pop(twin_id, None)
+    if entry == None:
+        return
+    entry['timer'].cancel()
+
+    if entry['emit'] != None:
+        emit_stats['flushed'] += 1
+        try:
+            entry['emit'](entry['value'])
+        except Exception as e:
+            print('WARNING: could not publish coalesced value of twin {}: {}'.format(twin_id, e))
+
+
+def flush(force=False):
+    """
+    Close windows that have expired, or all windows if force.
+    Serves as a fallback for timers that did not get to run, e.g. while
+    the instance was idle, and to publish final values at the end of a batch.
+
+    Parameters
+    ----------
+    force : bool
+        Close all windows, not only expired ones.
+
+    """
+
+    now = time.time()
+    with windows_lock:
+        expired = [twin_id for twin_id, entry in windows.items()
+                   if force or now - entry['opened'] >= entry['window']]
+    for twin_id in expired:
+        close_window(twin_id)
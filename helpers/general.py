@@ -1,11 +1,63 @@
 # packages
-import numpy  as np
-import pandas as pd
+import re
+import datetime
+
+# RFC 3339 timestamp as used in API event data, e.g. 2020-10-19T12:34:56.123456789Z
+RFC3339_PATTERN = re.compile(
+    r'(\d{4}-\d{2}-\d{2})[Tt ](\d{2}:\d{2}:\d{2})(?:\.(\d{1,9}))?([Zz]|[+-]\d{2}:\d{2})$'
+)
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def parse_event_data_timestamp(ts):
+    """
+    Parse an API event data timestamp to nanoseconds since epoch.
+    Accepts RFC 3339 timestamps with up to nine fractional digits.
+
+    Parameters
+    ----------
+    ts : str
+        UTC timestamp in custom API event data format.
+
+    Returns
+    -------
+    naive : datetime
+        Timestamp date and time in its own zone, without fraction.
+    unixtime_ns : int
+        Integer number of nanoseconds since 1 January 1970.
+    offset : int
+        UTC offset of the timestamp in seconds.
+
+    """
+
+    # fast path for the UTC format emitted by the API
+    fraction = ts[20:-1]
+    if ts[-1:] == 'Z' and (len(ts) == 20 or (fraction.isdigit() and ts[19] == '.' and len(fraction) <= 9)):
+        naive  = datetime.datetime.fromisoformat(ts[:19])
+        offset = 0
+
+    # any other RFC 3339 timestamp
+    else:
+        match = RFC3339_PATTERN.match(ts)
+        if match == None:
+            raise ValueError('invalid timestamp: {}'.format(ts))
+        date, clock, fraction, zone = match.groups()
+        naive  = datetime.datetime.fromisoformat(date + 'T' + clock)
+        offset = 0
+        if zone not in ('Z', 'z'):
+            offset = (int(zone[1:3]) * 3600 + int(zone[4:6]) * 60) * (-1 if zone[0] == '-' else 1)
+
+    # whole seconds since epoch, then fraction padded to nanoseconds
+    delta   = naive - EPOCH
+    seconds = delta.days * 86400 + delta.seconds - offset
+    nanoseconds = int(fraction.ljust(9, '0')) if fraction else 0
+
+    return naive, seconds * 10**9 + nanoseconds, offset
 
 
 def convert_event_data_timestamp(ts):
     """
-    Convert the default event_data timestamp format to Pandas and unixtime format.
+    Convert the default event_data timestamp format to datetime and unixtime format.
 
     Parameters
     ----------
@@ -15,13 +67,15 @@ def convert_event_data_timestamp(ts):
     Returns
     -------
     timestamp : datetime
-        Pandas Timestamp object format.
+        Timezone aware datetime object, truncated to microseconds.
     unixtime : int
         Integer number of seconds since 1 January 1970.
     """
 
-    timestamp = pd.to_datetime(ts)
-    unixtime  = pd.to_datetime(np.array([ts])).astype(int)[0] // 10**9
+    naive, unixtime_ns, offset = parse_event_data_timestamp(ts)
 
-    return timestamp, unixtime
+    # attach zone and fraction truncated to microseconds
+    tz = datetime.timezone.utc if offset == 0 else datetime.timezone(datetime.timedelta(seconds=offset))
+    timestamp = naive.replace(microsecond=(unixtime_ns % 10**9) // 1000, tzinfo=tz)
 
+    return timestamp, unixtime_ns // 10**9
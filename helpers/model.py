@@ -0,0 +1,178 @@
+# packages
+# numpy is imported where used, it is only needed for vectorized batches
+import os
+import math
+
+# default discretization of the model, overridden per twin by a device label
+# euler is the original forward step, exact follows the analytic decay and
+# stays stable for reporting intervals of any length
+INERTIA_METHOD = os.environ.get('INERTIA_METHOD', 'euler')
+
+
+def euler_step(previous_value, previous_ux, temperature, ux, k):
+    """
+    Advance the first-order inertia model by one event.
+
+    Parameters
+    ----------
+    previous_value : float
+        Previous modeled temperature.
+    previous_ux : float
+        Unixtime of previous modeled temperature.
+    temperature : float
+        Temperature of the new event.
+    ux : float
+        Unixtime of the new event.
+    k : float
+        Model coefficient per minute.
+
+    Returns
+    -------
+    value : float
+        New modeled temperature.
+
+    """
+
+    # normalise by the minute
+    normaliser = (ux - previous_ux) / (60)
+
+    # calculate new model delta
+    dt = -k*(previous_value - temperature)
+
+    return previous_value + dt*normaliser
+
+
+def exact_step(previous_value, previous_ux, temperature, ux, k):
+    """
+    Advance the first-order inertia model by one event with the exact
+    solution for a temperature held constant since the previous event.
+    Unlike euler_step it never overshoots the event temperature.
+
+    Parameters
+    ----------
+    previous_value : float
+        Previous modeled temperature.
+    previous_ux : float
+        Unixtime of previous modeled temperature.
+    temperature : float
+        Temperature of the new event.
+    ux : float
+        Unixtime of the new event.
+    k : float
+        Model coefficient per minute.
+
+    Returns
+    -------
+    value : float
+        New modeled temperature.
+
+    """
+
+    return temperature + (previous_value - temperature) * math.exp(-k * (ux - previous_ux) / 60)
+
+
+# model steps by discretization name
+STEPS = {'euler': euler_step, 'exact': exact_step}
+
+
+def integrate_events(unixtimes, temperatures, coefficients, twin_ids, initial=None, exact=False):
+    """
+    Run the inertia model over a batch of events for many twins at once.
+    Events are applied in the given order per twin, equal to calling
+    euler_step or exact_step event by event. Each step is an affine map of the previous
+    value, so all sequences are solved with a segmented prefix scan over
+    those maps in log2(longest sequence) vectorized passes.
+
+    Parameters
+    ----------
+    unixtimes : array_like
+        Unixtime of each event.
+    temperatures : array_like
+        Temperature of each event.
+    coefficients : array_like
+        Model coefficient of each event.
+    twin_ids : array_like
+        Identifier of the twin each event belongs to.
+    initial : dict
+        Optional previous state per twin identifier as (value, unixtime).
+        Twins without state start at the temperature of their first event.
+    exact : bool or array_like
+        Use the exact discretization, for all events or per event.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        Modeled temperature after each event, in input order.
+    state : dict
+        Final (value, unixtime) per twin identifier, usable as initial
+        for a following batch.
+
+    """
+
+    import numpy as np
+
+    ux    = np.asarray(unixtimes, dtype=float)
+    temp  = np.asarray(temperatures, dtype=float)
+    k     = np.asarray(coefficients, dtype=float)
+    exact = np.broadcast_to(np.asarray(exact, dtype=bool), ux.shape)
+    n     = len(ux)
+    if n == 0:
+        return np.empty(0), dict(initial or {})
+
+    # sort events by twin, keeping their order within a twin
+    twin_ids = np.asarray(twin_ids)
+    order = np.argsort(twin_ids, kind='stable')
+    sorted_ids = twin_ids[order]
+    ux, temp, k, exact = ux[order], temp[order], k[order], exact[order]
+    first = np.ones(n, dtype=bool)
+    first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+    codes = np.cumsum(first) - 1
+    ids = sorted_ids[first]
+
+    # previous state of each event, the initial state at segment starts
+    init_value = np.zeros(len(ids))
+    init_ux    = np.full(len(ids), np.nan)
+    if initial:
+        for i, twin_id in enumerate(ids.tolist()):
+            if twin_id in initial:
+                init_value[i], init_ux[i] = initial[twin_id]
+    prev_ux = np.empty(n)
+    prev_ux[1:] = ux[:-1]
+    prev_ux[first] = init_ux[codes[first]]
+
+    # each event maps the previous value y to a*y + b
+    decay = k * (ux - prev_ux) / 60
+    if exact.any():
+        a = np.where(exact, np.exp(-decay), 1 - decay)
+    else:
+        a = 1 - decay
+    b = temp - a * temp
+
+    # segments without initial state start at the event temperature
+    fresh = first & np.isnan(prev_ux)
+    a[fresh] = 0
+    b[fresh] = temp[fresh]
+
+    # segmented inclusive scan composing the maps
+    shift = 1
+    longest = np.max(np.bincount(codes))
+    while shift < longest:
+        same = codes[shift:] == codes[:-shift]
+        a_tail = np.where(same, a[:-shift], 1) * a[shift:]
+        b_tail = np.where(same, b[:-shift], 0) * a[shift:] + b[shift:]
+        a[shift:] = a_tail
+        b[shift:] = b_tail
+        shift *= 2
+
+    # apply composed maps to initial values, then restore input order
+    sorted_values = a * init_value[codes] + b
+    values = np.empty(n)
+    values[order] = sorted_values
+
+    # final state per twin
+    state = dict(initial or {})
+    last = np.append(np.nonzero(first)[0][1:] - 1, n - 1)
+    for twin_id, value, t in zip(ids[codes[last]].tolist(), sorted_values[last].tolist(), ux[last].tolist()):
+        state[twin_id] = (value, t)
+
+    return values, state
@@ -0,0 +1,544 @@
+# packages
+import os
+import time
+import threading
+
+# project
+import helpers.session as http
+
+# registry configuration
+# entries younger than TTL are served as is, entries younger than STALE are
+# served while being refreshed in the background, older entries are refetched
+# indexes are patched from events and API responses, so both can be long
+DEVICE_REGISTRY_TTL   = float(os.environ.get('DEVICE_REGISTRY_TTL', 900))
+DEVICE_REGISTRY_STALE = float(os.environ.get('DEVICE_REGISTRY_STALE', 3600))
+
+# devices requested per page when listing a project
+DEVICE_PAGE_SIZE = int(os.environ.get('DEVICE_PAGE_SIZE', 1000))
+
+# studio labels
+EMULATED_PREFIX       = 'emu'
+ORIGINAL_DEVICE_LABEL = 'original_device_id'
+
+# per-project device indexes, reused across warm invocations
+# refetches of one project are serialized by its refresh lock
+registries    = {}
+refresh_locks = {}
+registry_lock = threading.Lock()
+
+
+def device_identifier(device):
+    """
+    Isolate the identifier of a device from its full resource name.
+
+    Parameters
+    ----------
+    device : dict
+        Dictionary of device information fetched by the API.
+
+    Returns
+    -------
+    device_id : str
+        Identifier of device.
+
+    """
+
+    return device['name'].split('/')[-1]
+
+
+def add_entry(index, device):
+    # insert or replace a device, without recording the patch
+    device_id = device_identifier(device)
+    index['devices'][device_id] = device
+
+    # emulated twins are also indexed by their original device
+    if device_id.startswith(EMULATED_PREFIX) and ORIGINAL_DEVICE_LABEL in device['labels'].keys():
+        original_id = device['labels'][ORIGINAL_DEVICE_LABEL]
+        index['twins'].setdefault(original_id, {})[device_id] = device
+
+
+def drop_entry(index, device_id):
+    # remove a device, without recording the patch
+    device = index['devices'].pop(device_id, None)
+    if device == None:
+        return
+
+    # drop twin entry if the device was an indexed twin
+    original_id = device['labels'].get(ORIGINAL_DEVICE_LABEL)
+    if original_id in index['twins']:
+        index['twins'][original_id].pop(device_id, None)
+        if len(index['twins'][original_id]) == 0:
+            del index['twins'][original_id]
+
+
+def record_patch(index, device_id, device):
+    # journal a patch while the index is being refetched, so it is applied
+    # to the new index too, and forward it if the index was already replaced
+    with registry_lock:
+        if index.get('journal') != None:
+            index['journal'].append((device_id, device))
+        successor = index.get('successor')
+
+    if successor != None:
+        drop_entry(successor, device_id)
+        if device != None:
+            add_entry(successor, device)
+        record_patch(successor, device_id, device)
+
+
+def index_device(index, device):
+    """
+    Insert or replace a device in a project index.
+
+    Parameters
+    ----------
+    index : dict
+        Project device index created by build_index.
+    device : dict
+        Dictionary of device information fetched by the API.
+
+    """
+
+    add_entry(index, device)
+    record_patch(index, device_identifier(device), device)
+
+
+def remove_device(index, device_id):
+    """
+    Remove a device from a project index.
+
+    Parameters
+    ----------
+    index : dict
+        Project device index created by build_index.
+    device_id : str
+        Identifier of device to be removed.
+
+    """
+
+    drop_entry(index, device_id)
+    record_patch(index, device_id, None)
+
+
+def apply_labels_changed(index, device_id, data):
+    """
+    Patch the labels of an indexed device from a labelsChanged event.
+    Emulated twins are reindexed if their original device label changed.
+
+    Parameters
+    ----------
+    index : dict
+        Project device index created by build_index.
+    device_id : str
+        Identifier of device the event originates from.
+    data : dict
+        Data field of labelsChanged event with keys added, modified and removed.
+
+    Returns
+    -------
+    patched : bool
+        False if the device is not in the index.
+
+    """
+
+    device = index['devices'].get(device_id)
+    if device == None:
+        return False
+
+    # reindex with updated labels
+    remove_device(index, device_id)
+    device['labels'].update(data.get('added', {}))
+    device['labels'].update(data.get('modified', {}))
+    for key in data.get('removed', []):
+        device['labels'].pop(key, None)
+    index_device(index, device)
+
+    return True
+
+
+def build_index(device_list):
+    """
+    Build hash indexes over a project device list.
+
+    Parameters
+    ----------
+    device_list : iterable
+        Project device dictionaries fetched by the API.
+
+    Returns
+    -------
+    index : dict
+        Dictionary with devices keyed by identifier under 'devices' and
+        emulated twins keyed by original device identifier under 'twins'.
+
+    """
+
+    index = {
+        'devices': {},
+        'twins': {},
+        'fetched': time.time(),
+        'refreshing': False,
+        'journal': None,
+        'successor': None,
+    }
+    for device in device_list:
+        add_entry(index, device)
+
+    return index
+
+
+def iter_devices(api_url_base, project_id, access_token, page_size=None, filters=None):
+    """
+    Iterate the devices of a project, one page at a time.
+    Follows nextPageToken until the last page, so only a single page is
+    held in memory and callers can stop early.
+
+    Parameters
+    ----------
+    api_url_base : str
+        Base URL of the DT REST API.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+    page_size : int
+        Devices requested per page. Defaults to DEVICE_PAGE_SIZE.
+    filters : dict
+        Additional query parameters, e.g. labelFilters, evaluated server side.
+
+    Yields
+    ------
+    device : dict
+        Dictionary of device information fetched by the API.
+
+    """
+
+    devices_list_url = "{}/projects/{}/devices".format(api_url_base, project_id)
+    params = dict(filters or {})
+    params['pageSize'] = page_size or DEVICE_PAGE_SIZE
+
+    while True:
+        r = http.get(devices_list_url, access_token, params=params)
+        if r.status_code != 200:
+            raise RuntimeError('device list request failed with status {}'.format(r.status_code))
+        page = r.json()
+        for device in page['devices']:
+            yield device
+
+        # stop after last page
+        if not page.get('nextPageToken'):
+            return
+        params['pageToken'] = page['nextPageToken']
+
+
+def fetch_device(api_url_base, project_id, device_id, access_token):
+    """
+    Fetch a single device by identifier.
+
+    Parameters
+    ----------
+    api_url_base : str
+        Base URL of the DT REST API.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    device_id : str
+        Identifier of device to fetch.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+
+    Returns
+    -------
+    device : dict
+        Dictionary of device information fetched by the API.
+        Returns None if the device does not exist.
+
+    """
+
+    device_url = "{}/projects/{}/devices/{}".format(api_url_base, project_id, device_id)
+    r = http.get(device_url, access_token)
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        raise RuntimeError('device request failed with status {}'.format(r.status_code))
+
+    return r.json()
+
+
+def is_related(device, device_id):
+    """
+    Check if a device is the original device device_id or one of its twins.
+
+    Parameters
+    ----------
+    device : dict
+        Dictionary of device information fetched by the API.
+    device_id : str
+        Identifier of original device.
+
+    Returns
+    -------
+    related : bool
+        True if device is the original device or one of its twins.
+
+    """
+
+    return device_identifier(device) == device_id or device['labels'].get(ORIGINAL_DEVICE_LABEL) == device_id
+
+
+def refresh_lock(project_id):
+    # lock serializing the refetches of one project
+    with registry_lock:
+        return refresh_locks.setdefault(project_id, threading.Lock())
+
+
+def refresh_index(api_url_base, project_id, access_token):
+    """
+    Refetch the device list of a project and replace its index.
+    Patches made to the cached index during the fetch, like spawned or
+    deleted twins, are applied to the new index, and later patches to the
+    replaced index are forwarded to it. Callers hold the refresh lock.
+
+    Parameters
+    ----------
+    api_url_base : str
+        Base URL of the DT REST API.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+
+    Returns
+    -------
+    index : dict
+        Newly built project device index.
+
+    """
+
+    if DEVICE_REGISTRY_TTL <= 0:
+        return build_index(iter_devices(api_url_base, project_id, access_token))
+
+    # journal patches to the cached index while fetching
+    with registry_lock:
+        previous = registries.get(project_id)
+        if previous != None:
+            previous['journal'] = []
+
+    try:
+        index = build_index(iter_devices(api_url_base, project_id, access_token))
+    except Exception:
+        with registry_lock:
+            if previous != None:
+                previous['journal'] = None
+        raise
+
+    # replay the journal and swap, patches to previous now go to index
+    with registry_lock:
+        if previous != None:
+            for device_id, device in previous['journal']:
+                drop_entry(index, device_id)
+                if device != None:
+                    add_entry(index, device)
+            previous['journal'] = None
+            previous['successor'] = index
+        registries[project_id] = index
+
+    return index
+
+
+def background_refresh(api_url_base, project_id, access_token):
+    """
+    Refresh a project index in a separate thread.
+    Failures leave the stale index in place.
+
+    """
+
+    try:
+        with refresh_lock(project_id):
+            refresh_index(api_url_base, project_id, access_token)
+    except Exception as e:
+        print('WARNING: device registry refresh failed: {}'.format(e))
+        with registry_lock:
+            if project_id in registries:
+                registries[project_id]['refreshing'] = False
+
+
+def get_index(api_url_base, project_id, access_token):
+    """
+    Return the device index of a project.
+    Fresh indexes are served from memory, stale ones are served while
+    being revalidated in the background and expired ones are refetched.
+
+    Parameters
+    ----------
+    api_url_base : str
+        Base URL of the DT REST API.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+
+    Returns
+    -------
+    index : dict
+        Project device index, see build_index.
+
+    """
+
+    index = registries.get(project_id)
+
+    # missing or expired, block on a single full fetch per project
+    if index == None or time.time() - index['fetched'] > DEVICE_REGISTRY_STALE:
+        with refresh_lock(project_id):
+            index = registries.get(project_id)
+            if index == None or time.time() - index['fetched'] > DEVICE_REGISTRY_STALE:
+                return refresh_index(api_url_base, project_id, access_token)
+
+    # stale, serve as is and revalidate
+    if time.time() - index['fetched'] > DEVICE_REGISTRY_TTL:
+        with registry_lock:
+            start = not index['refreshing']
+            index['refreshing'] = True
+        if start:
+            threading.Thread(target=background_refresh,
+                             args=(api_url_base, project_id, access_token),
+                             daemon=True).start()
+
+    return index
+
+
+def cached_index(project_id):
+    """
+    Return the cached device index of a project without fetching.
+
+    Parameters
+    ----------
+    project_id : str
+        Identifier of the project we're interfacing with.
+
+    Returns
+    -------
+    index : dict
+        Project device index younger than DEVICE_REGISTRY_TTL, see
+        build_index. Returns None if there is none.
+
+    """
+
+    index = registries.get(project_id)
+    if index == None or time.time() - index['fetched'] > DEVICE_REGISTRY_TTL:
+        return None
+
+    return index
+
+
+def fetch_twins(api_url_base, project_id, device_id, access_token):
+    """
+    Fetch the emulated twins of a device through a server-side label filter.
+
+    Parameters
+    ----------
+    api_url_base : str
+        Base URL of the DT REST API.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    device_id : str
+        Identifier of original device.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+
+    Returns
+    -------
+    twins : list
+        Dictionaries of the twins of device_id.
+
+    """
+
+    label_filter = {'labelFilters': '{}={}'.format(ORIGINAL_DEVICE_LABEL, device_id)}
+    return list(iter_devices(api_url_base, project_id, access_token, filters=label_filter))
+
+
+def lookup_index(api_url_base, project_id, device_id, access_token):
+    """
+    Build an uncached index holding only device device_id and its twins.
+    The original device is requested by identifier and its twins through a
+    server-side label filter, so the payload does not grow with the project.
+    If the filtered requests fail, the full device list is streamed instead.
+
+    Parameters
+    ----------
+    api_url_base : str
+        Base URL of the DT REST API.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    device_id : str
+        Identifier of original device.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+
+    Returns
+    -------
+    index : dict
+        Project device index, see build_index.
+
+    """
+
+    # ask the API for the related devices only
+    try:
+        original = fetch_device(api_url_base, project_id, device_id, access_token)
+        twins = fetch_twins(api_url_base, project_id, device_id, access_token)
+        return build_index(([original] if original != None else []) + twins)
+    except (RuntimeError, KeyError, ValueError) as e:
+        print('WARNING: filtered device lookup failed, scanning project: {}'.format(e))
+
+    # fall back to scanning the full project
+    devices = iter_devices(api_url_base, project_id, access_token)
+    return build_index(device for device in devices if is_related(device, device_id))
+
+
+def merge_index(index, partial):
+    """
+    Insert the devices of a partial index into a project index.
+
+    Parameters
+    ----------
+    index : dict
+        Project device index created by build_index.
+    partial : dict
+        Index of a subset of devices, e.g. from lookup_index.
+
+    """
+
+    for device in partial['devices'].values():
+        remove_device(index, device_identifier(device))
+        index_device(index, device)
+
+
+def record_temperature(twin, value, update_time):
+    """
+    Store an emitted temperature as the reported state of an indexed twin.
+    Keeps cached twins consistent with what has been published.
+
+    Parameters
+    ----------
+    twin : dict
+        Dictionary of emulated twin device information.
+    value : float
+        Temperature value emitted to the twin.
+    update_time : str
+        Timestamp of the emitted value in API event data format.
+
+    """
+
+    twin.setdefault('reported', {})['temperature'] = {
+        'value': value,
+        'updateTime': update_time,
+    }
+
+
+def clear():
+    """
+    Drop all cached project indexes.
+
+    """
+
+    with registry_lock:
+        registries.clear()
@@ -0,0 +1,383 @@
+# packages
+# requests is imported where used to keep cold starts short
+import os
+import time
+import random
+import threading
+import contextvars
+import email.utils
+import urllib.parse
+
+# project
+import helpers.trace as trace
+
+# connection pool configuration
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_TIMEOUT   = float(os.environ.get('HTTP_TIMEOUT', 10))
+HTTP_HEADERS   = {'Accept': 'application/json'}
+
+# retry configuration
+# throttled and unavailable responses are retried for every method, other
+# 5xx responses and connection errors only for idempotent requests
+HTTP_RETRIES       = int(os.environ.get('HTTP_RETRIES', 3))
+HTTP_BACKOFF       = float(os.environ.get('HTTP_BACKOFF', 0.2))
+HTTP_BACKOFF_MAX   = float(os.environ.get('HTTP_BACKOFF_MAX', 5))
+RETRY_ALWAYS       = {429, 503}
+RETRY_IDEMPOTENT   = {500, 502, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'PATCH', 'DELETE'}
+
+# deadline configuration
+# outbound calls of one invocation, retries and backoff included, must end
+# within HTTP_DEADLINE seconds of its start, so they finish before the
+# platform timeout, 0 disables
+HTTP_DEADLINE = float(os.environ.get('HTTP_DEADLINE', 25))
+
+# circuit breaker configuration
+# a host failing BREAKER_THRESHOLD requests in a row is not called for
+# BREAKER_COOLDOWN seconds, after which a single trial request is let through
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN  = float(os.environ.get('BREAKER_COOLDOWN', 30))
+
+# shared session and breakers per host, reused across warm invocations
+session      = None
+session_lock = threading.Lock()
+breakers     = {}
+breaker_lock = threading.Lock()
+
+# monotonic deadline of the current invocation
+deadline = contextvars.ContextVar('http_deadline', default=None)
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of sending a request to a host whose circuit is open.
+
+    """
+
+
+class CircuitBreaker:
+    """
+    Consecutive failure counter of one upstream host.
+
+    Parameters
+    ----------
+    threshold : int
+        Consecutive failures that open the circuit.
+    cooldown : float
+        Seconds the circuit stays open before a trial request.
+
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown  = cooldown
+        self.failures  = 0
+        self.opened    = None
+        self.trial     = False
+        self.lock      = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened == None:
+                return True
+            # half open, let a single trial through after the cooldown
+            if not self.trial and time.monotonic() - self.opened >= self.cooldown:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened   = None
+            self.trial    = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened == None and self.failures >= self.threshold):
+                self.opened = time.monotonic()
+                self.trial  = False
+
+
+def get_breaker(url):
+    """
+    Return the circuit breaker of the host of url.
+
+    """
+
+    host = urllib.parse.urlsplit(url).netloc
+    if host not in breakers:
+        with breaker_lock:
+            if host not in breakers:
+                breakers[host] = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+    return breakers[host]
+
+
+def start_deadline(seconds=None):
+    """
+    Start the outbound call deadline of the current invocation.
+
+    Parameters
+    ----------
+    seconds : float
+        Seconds from now. Defaults to HTTP_DEADLINE, 0 disables the deadline.
+
+    """
+
+    if seconds == None:
+        seconds = HTTP_DEADLINE
+    deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+
+
+def remaining():
+    """
+    Seconds left before the deadline of the current invocation.
+    Returns None if there is no deadline.
+
+    """
+
+    d = deadline.get()
+    return None if d == None else d - time.monotonic()
+
+
+def attempt_timeout(timeout):
+    """
+    Timeout of the next attempt, cut to the time left before the deadline.
+    Returns None if the deadline has passed.
+
+    """
+
+    left = remaining()
+    if left == None:
+        return timeout
+    if left <= 0:
+        return None
+
+    return min(timeout, left)
+
+
+def retry_fits(delay, timeout):
+    """
+    Whether a retry after delay seconds can wait out its full timeout
+    before the deadline.
+
+    """
+
+    left = remaining()
+    return left == None or left - delay >= timeout
+
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Seconds to wait before retrying a failed request.
+
+    Parameters
+    ----------
+    attempt : int
+        Number of the failed attempt, starting at 0.
+    retry_after : str
+        Retry-After header of the response, in seconds or as an HTTP date.
+
+    Returns
+    -------
+    delay : float
+        Full jitter exponential backoff, or the time asked for by Retry-After.
+        Returns None if the server asks for more than HTTP_BACKOFF_MAX.
+
+    """
+
+    if retry_after != None:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay != None:
+            return max(0.0, delay) if delay <= HTTP_BACKOFF_MAX else None
+
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF * 2**attempt))
+
+
+def should_retry(method, status_code, idempotent=None):
+    """
+    Whether a response status is worth retrying for the given method.
+    A status_code of None stands for a connection error or timeout.
+
+    """
+
+    if idempotent == None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    if status_code in RETRY_ALWAYS:
+        return True
+
+    return idempotent and (status_code == None or status_code in RETRY_IDEMPOTENT)
+
+
+def is_failure(status_code):
+    """
+    Whether a response status counts against the circuit breaker of its host.
+
+    """
+
+    return status_code == None or status_code >= 500
+
+
+def transport_errors():
+    """
+    Exception types raised by request for failed calls, like timeouts and
+    connection errors left after retries. Resolved when needed, so requests
+    is still imported on first use.
+
+    """
+
+    import requests
+    return (requests.RequestException,)
+
+
+def is_timeout(error):
+    """
+    Whether a failed call timed out, as opposed to failing to connect.
+
+    """
+
+    import requests
+    return isinstance(error, (requests.Timeout, TimeoutError))
+
+
+def get_session():
+    """
+    Return the shared HTTP session, creating it on first use.
+    Keeps connections alive so TLS setup is paid once per host and instance.
+
+    Returns
+    -------
+    session : requests.Session
+        Session with pooled keep-alive connections.
+
+    """
+
+    global session
+
+    if session == None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with session_lock:
+            if session == None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                s.mount('https://', adapter)
+                s.mount('http://', adapter)
+                s.headers.update(HTTP_HEADERS)
+                session = s
+
+    return session
+
+
+def request(method, url, access_token=None, timeout=None, headers=None, idempotent=None, **kwargs):
+    """
+    Send a request through the shared session.
+    Retries throttled and failed requests with backoff, and fails fast
+    while the circuit of the host is open. No attempt outlasts the deadline
+    of the invocation and no retry is started that could not wait out its
+    timeout before it.
+
+    Parameters
+    ----------
+    method : str
+        HTTP method, e.g. 'GET' or 'POST'.
+    url : str
+        Target URL.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+        Sent as Authorization header if given.
+    timeout : float
+        Seconds to wait for the server. Defaults to HTTP_TIMEOUT.
+    headers : dict
+        Additional headers merged into the session defaults.
+    idempotent : bool
+        Whether repeating the request is safe, so 5xx responses and connection
+        errors are retried. Defaults to True for GET, HEAD, PUT, PATCH and DELETE.
+
+    Returns
+    -------
+    response : requests.Response
+        Last response received from the server.
+
+    Raises
+    ------
+    CircuitOpenError
+        If the circuit of the host is open.
+    requests.Timeout
+        If the deadline of the invocation has passed.
+
+    """
+
+    import requests
+
+    headers = dict(headers or {})
+    if access_token != None:
+        headers['Authorization'] = access_token
+
+    if timeout == None:
+        timeout = HTTP_TIMEOUT
+
+    breaker = get_breaker(url)
+    attempt = 0
+    while True:
+        # check the deadline first, a half-open breaker hands out its trial once
+        limit = attempt_timeout(timeout)
+        if limit == None:
+            raise requests.Timeout('invocation deadline passed before {} {}'.format(method, url))
+
+        if not breaker.allow():
+            raise CircuitOpenError('circuit open for {}'.format(urllib.parse.urlsplit(url).netloc))
+
+        # report every attempt to the breaker, also one ended by another exception
+        trace.count('http_calls')
+        r, error, status_code, retry_after = None, None, None, None
+        try:
+            r = get_session().request(method, url, headers=headers, timeout=limit, **kwargs)
+            status_code, retry_after = r.status_code, r.headers.get('Retry-After')
+        except requests.RequestException as e:
+            error = e
+        finally:
+            if is_failure(status_code):
+                breaker.failure()
+            else:
+                breaker.success()
+
+        # give up once out of attempts or if the request should not be repeated
+        delay = None
+        if attempt < HTTP_RETRIES and should_retry(method, status_code, idempotent):
+            delay = retry_delay(attempt, retry_after)
+        if delay != None and not retry_fits(delay, timeout):
+            delay = None
+        if delay == None:
+            if error != None:
+                raise error
+            return r
+
+        trace.count('http_retries')
+        time.sleep(delay)
+        attempt += 1
+
+
+def get(url, access_token=None, **kwargs):
+    return request('GET', url, access_token, **kwargs)
+
+
+def post(url, access_token=None, **kwargs):
+    return request('POST', url, access_token, **kwargs)
+
+
+def patch(url, access_token=None, **kwargs):
+    return request('PATCH', url, access_token, **kwargs)
+
+
+def delete(url, access_token=None, **kwargs):
+    return request('DELETE', url, access_token, **kwargs)
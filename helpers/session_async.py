@@ -0,0 +1,194 @@
+# packages
+# aiohttp and its multidict are imported where used, they are only needed by
+# the async handler
+import json
+import asyncio
+import urllib.parse
+
+# project
+import helpers.trace   as trace
+import helpers.session as http
+
+# shared sessions, one per event loop
+sessions = {}
+
+
+class Response:
+    """
+    Fully read response of an async request.
+    Mirrors the parts of requests.Response used by the handler.
+
+    Parameters
+    ----------
+    status_code : int
+        HTTP status code of the response.
+    content : bytes
+        Response body.
+    headers : multidict.CIMultiDict
+        Response headers, looked up case-insensitively like those of
+        requests.Response.
+
+    """
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content     = content
+        self.headers     = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def transport_errors():
+    """
+    Exception types of failed async and sync calls, see
+    helpers.session.transport_errors.
+
+    """
+
+    import aiohttp
+    return http.transport_errors() + (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def is_timeout(error):
+    """
+    Whether a failed async or sync call timed out.
+
+    """
+
+    return http.is_timeout(error) or isinstance(error, asyncio.TimeoutError)
+
+
+def get_session():
+    """
+    Return the shared async HTTP session of the running event loop.
+    Keeps connections alive with the same pool size as the sync session.
+
+    Returns
+    -------
+    session : aiohttp.ClientSession
+        Session with pooled keep-alive connections.
+
+    """
+
+    import aiohttp
+
+    loop = asyncio.get_event_loop()
+    if loop not in sessions or sessions[loop].closed:
+        connector = aiohttp.TCPConnector(limit_per_host=http.HTTP_POOL_SIZE)
+        sessions[loop] = aiohttp.ClientSession(connector=connector, headers=http.HTTP_HEADERS)
+
+    return sessions[loop]
+
+
+async def close():
+    """
+    Close the session of the running event loop, e.g. at server shutdown.
+
+    """
+
+    session = sessions.pop(asyncio.get_event_loop(), None)
+    if session != None:
+        await session.close()
+
+
+async def request(method, url, access_token=None, timeout=None, headers=None, idempotent=None, **kwargs):
+    """
+    Send a request through the shared async session.
+    Retries and circuit breakers are shared with the sync session.
+
+    Parameters
+    ----------
+    method : str
+        HTTP method, e.g. 'GET' or 'POST'.
+    url : str
+        Target URL.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+        Sent as Authorization header if given.
+    timeout : float
+        Seconds to wait for the server. Defaults to HTTP_TIMEOUT.
+    headers : dict
+        Additional headers merged into the session defaults.
+    idempotent : bool
+        Whether repeating the request is safe, see helpers.session.request.
+
+    Returns
+    -------
+    response : Response
+        Status code and body of the last response received from the server.
+
+    Raises
+    ------
+    helpers.session.CircuitOpenError
+        If the circuit of the host is open.
+
+    """
+
+    import aiohttp
+    import multidict
+
+    headers = dict(headers or {})
+    if access_token != None:
+        headers['Authorization'] = access_token
+
+    if timeout == None:
+        timeout = http.HTTP_TIMEOUT
+
+    session = get_session()
+    breaker = http.get_breaker(url)
+    attempt = 0
+    while True:
+        # check the deadline first, a half-open breaker hands out its trial once
+        limit = http.attempt_timeout(timeout)
+        if limit == None:
+            raise asyncio.TimeoutError('invocation deadline passed before {} {}'.format(method, url))
+
+        if not breaker.allow():
+            raise http.CircuitOpenError('circuit open for {}'.format(urllib.parse.urlsplit(url).netloc))
+
+        # report every attempt to the breaker, also one cancelled mid-flight
+        trace.count('http_calls')
+        response, error, status_code = None, None, None
+        try:
+            async with session.request(method, url, headers=headers, timeout=aiohttp.ClientTimeout(total=limit), **kwargs) as r:
+                response = Response(r.status, await r.read(), multidict.CIMultiDict(r.headers))
+            status_code = response.status_code
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        finally:
+            if http.is_failure(status_code):
+                breaker.failure()
+            else:
+                breaker.success()
+
+        # give up once out of attempts or if the request should not be repeated
+        delay = None
+        if attempt < http.HTTP_RETRIES and http.should_retry(method, status_code, idempotent):
+            delay = http.retry_delay(attempt, None if response == None else response.headers.get('Retry-After'))
+        if delay != None and not http.retry_fits(delay, timeout):
+            delay = None
+        if delay == None:
+            if error != None:
+                raise error
+            return response
+
+        trace.count('http_retries')
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def get(url, access_token=None, **kwargs):
+    return await request('GET', url, access_token, **kwargs)
+
+
+async def post(url, access_token=None, **kwargs):
+    return await request('POST', url, access_token, **kwargs)
+
+
+async def patch(url, access_token=None, **kwargs):
+    return await request('PATCH', url, access_token, **kwargs)
+
+
+async def delete(url, access_token=None, **kwargs):
+    return await request('DELETE', url, access_token, **kwargs)
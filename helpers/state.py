@@ -0,0 +1,250 @@
+# packages
+# sqlite3 is imported where used, it is only needed by the sqlite store
+import os
+import mmap
+import zlib
+import fcntl
+import struct
+import hashlib
+import threading
+import collections
+
+# store configuration
+# memory keeps the last TWIN_STATE_SIZE twins per instance, sqlite and mmap
+# persist to TWIN_STATE_PATH and can be shared by processes on one host
+TWIN_STATE_STORE = os.environ.get('TWIN_STATE_STORE', 'memory')
+TWIN_STATE_PATH  = os.environ.get('TWIN_STATE_PATH', '/tmp/twin_state')
+TWIN_STATE_SIZE  = int(os.environ.get('TWIN_STATE_SIZE', 10000))
+
+# default store, created on first use
+store      = None
+store_lock = threading.Lock()
+
+
+class MemoryStore:
+    """
+    In-memory least recently used store of twin state.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of twins kept before the least recently used is evicted.
+
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries  = collections.OrderedDict()
+        self.lock     = threading.Lock()
+
+    def get(self, twin_id):
+        with self.lock:
+            if twin_id not in self.entries:
+                return None
+            self.entries.move_to_end(twin_id)
+            return self.entries[twin_id]
+
+    def put(self, twin_id, value, unixtime):
+        with self.lock:
+            self.entries[twin_id] = (value, unixtime)
+            self.entries.move_to_end(twin_id)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+
+class SQLiteStore:
+    """
+    Twin state persisted in an SQLite database.
+
+    Parameters
+    ----------
+    path : str
+        Path of the database file.
+
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        self.connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS twin_state (twin_id TEXT PRIMARY KEY, value REAL, unixtime REAL)'
+        )
+        self.lock = threading.Lock()
+
+    def get(self, twin_id):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value, unixtime FROM twin_state WHERE twin_id = ?', (twin_id,)
+            ).fetchone()
+        return None if row == None else (row[0], row[1])
+
+    def put(self, twin_id, value, unixtime):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO twin_state (twin_id, value, unixtime) VALUES (?, ?, ?)',
+                (twin_id, value, unixtime)
+            )
+
+
+class MmapStore:
+    """
+    Twin state in a fixed-size hash table of a memory-mapped file.
+    Slots are found by linear probing over at most PROBE_LIMIT slots, when
+    all of them are taken the home slot of a twin is overwritten, so the
+    file acts as a bounded cache. Lookups and writes hold a shared or
+    exclusive flock on the file, so processes on one host can share it.
+
+    Parameters
+    ----------
+    path : str
+        Path of the backing file, created if missing.
+    slots : int
+        Number of twins the table can hold.
+
+    """
+
+    # 32 byte key, value and unixtime
+    SLOT  = struct.Struct('32sdd')
+    EMPTY = bytes(32)
+
+    # longest probe sequence, bounds the cost of misses on a full table
+    PROBE_LIMIT = 16
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self.file = open(path, 'a+b')
+        # start from an empty table if the file does not match the slot count
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        try:
+            if os.path.getsize(path) != size:
+                self.file.truncate(0)
+                self.file.truncate(size)
+        finally:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.map  = mmap.mmap(self.file.fileno(), size)
+        self.lock = threading.Lock()
+
+    def key(self, twin_id):
+        # padded identifier, hashed if too long to fit
+        key = twin_id.encode()
+        if len(key) > 32:
+            return hashlib.blake2b(key, digest_size=32).digest()
+        return key.ljust(32, b'\0')
+
+    def find(self, key):
+        # slot holding key, or the first empty slot on its probe sequence
+        home = zlib.crc32(key) % self.slots
+        for i in range(min(self.slots, self.PROBE_LIMIT)):
+            offset = ((home + i) % self.slots) * self.SLOT.size
+            stored = self.map[offset:offset + 32]
+            if stored == key or stored == self.EMPTY:
+                return (home + i) % self.slots, stored == key
+        return home, False
+
+    def get(self, twin_id):
+        key = self.key(twin_id)
+        with self.lock:
+            fcntl.flock(self.file, fcntl.LOCK_SH)
+            try:
+                slot, found = self.find(key)
+                if not found:
+                    return None
+                _, value, unixtime = self.SLOT.unpack_from(self.map, slot * self.SLOT.size)
+            finally:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+        return value, unixtime
+
+    def put(self, twin_id, value, unixtime):
+        key = self.key(twin_id)
+        with self.lock:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+            try:
+                slot, _ = self.find(key)
+                self.SLOT.pack_into(self.map, slot * self.SLOT.size, key, value, unixtime)
+            finally:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+
+
+def create_store(kind, path=TWIN_STATE_PATH, size=TWIN_STATE_SIZE):
+    """
+    Create a twin state store.
+
+    Parameters
+    ----------
+    kind : str
+        One of 'memory', 'sqlite' or 'mmap'.
+    path : str
+        Backing file of persistent stores.
+    size : int
+        Capacity of the memory and mmap stores.
+
+    Returns
+    -------
+    store : object
+        Store with get(twin_id) and put(twin_id, value, unixtime) methods.
+
+    """
+
+    if kind == 'memory':
+        return MemoryStore(size)
+    if kind == 'sqlite':
+        return SQLiteStore(path)
+    if kind == 'mmap':
+        return MmapStore(path, size)
+    raise ValueError('unknown twin state store: {}'.format(kind))
+
+
+def get_store():
+    """
+    Return the default store configured by TWIN_STATE_STORE.
+
+    """
+
+    global store
+
+    if store == None:
+        with store_lock:
+            if store == None:
+                store = create_store(TWIN_STATE_STORE)
+
+    return store
+
+
+def lookup(twin_id):
+    """
+    Fetch the last emitted state of a twin from the default store.
+
+    Parameters
+    ----------
+    twin_id : str
+        Identifier of emulated twin.
+
+    Returns
+    -------
+    state : tuple
+        Last emitted value [0] and its unixtime [1].
+        Returns None if the twin is not in the store.
+
+    """
+
+    return get_store().get(twin_id)
+
+
+def record(twin_id, value, unixtime):
+    """
+    Save the last emitted state of a twin in the default store.
+
+    Parameters
+    ----------
+    twin_id : str
+        Identifier of emulated twin.
+    value : float
+        Emitted temperature value.
+    unixtime : float
+        Unixtime of the event the value was modeled from.
+
+    """
+
+    get_store().put(twin_id, value, unixtime)
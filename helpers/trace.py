@@ -0,0 +1,174 @@
+# packages
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+
+# trace configuration
+# one JSON line with stage timings and counts is printed per invocation
+TRACE_JSON = os.environ.get('TRACE_JSON', '1') == '1'
+
+# histogram buckets of stage and invocation durations in seconds
+TRACE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# trace of the running invocation, copied into executor threads by callers
+current = contextvars.ContextVar('trace', default=None)
+
+# aggregates over all invocations of the instance, for the metrics endpoint
+metrics      = {'stages': {}, 'invocations': {}, 'counts': {}}
+metrics_lock = threading.Lock()
+
+
+def start():
+    """
+    Start the trace of a new invocation in the current context.
+
+    Returns
+    -------
+    trace : dict
+        Stage durations in seconds and counts of the invocation.
+
+    """
+
+    trace = {'start': time.perf_counter(), 'stages': {}, 'counts': {}, 'lock': threading.Lock()}
+    current.set(trace)
+    return trace
+
+
+@contextlib.contextmanager
+def span(stage):
+    """
+    Time a stage of the current invocation.
+    Repeated stages, e.g. per event of a batch, add up.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage, like 'validate' or 'emit'.
+
+    """
+
+    trace = current.get()
+    if trace == None:
+        yield
+        return
+
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - begin
+        with trace['lock']:
+            trace['stages'][stage] = trace['stages'].get(stage, 0) + duration
+
+
+def count(name, n=1):
+    """
+    Add to a counter of the current invocation, e.g. outbound HTTP calls.
+
+    """
+
+    trace = current.get()
+    if trace != None:
+        with trace['lock']:
+            trace['counts'][name] = trace['counts'].get(name, 0) + n
+
+
+def observe(histograms, key, value):
+    # cumulative bucket counts, sum and count of one histogram
+    if key not in histograms:
+        histograms[key] = {'buckets': [0] * (len(TRACE_BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+    histogram = histograms[key]
+    histogram['buckets'][bisect.bisect_left(TRACE_BUCKETS, value)] += 1
+    histogram['sum']   += value
+    histogram['count'] += 1
+
+
+def finish(status):
+    """
+    End the trace of the current invocation.
+    Adds it to the instance metrics and prints it as a JSON line.
+
+    Parameters
+    ----------
+    status : tuple
+        Tuple with 2 cells containing status text [0] and status code [1].
+
+    Returns
+    -------
+    record : dict
+        Total and per stage milliseconds and counts of the invocation.
+        Returns None if no trace was started.
+
+    """
+
+    trace = current.get()
+    if trace == None:
+        return None
+    current.set(None)
+
+    total = time.perf_counter() - trace['start']
+    with metrics_lock:
+        observe(metrics['invocations'], str(status[1]), total)
+        for stage, duration in trace['stages'].items():
+            observe(metrics['stages'], stage, duration)
+        for name, n in trace['counts'].items():
+            metrics['counts'][name] = metrics['counts'].get(name, 0) + n
+
+    record = {
+        'code':     status[1],
+        'total_ms': round(total * 1000, 3),
+        'stages':   {stage: round(duration * 1000, 3) for stage, duration in trace['stages'].items()},
+        'counts':   dict(trace['counts']),
+    }
+    if TRACE_JSON:
+        print(json.dumps({'trace': record}))
+
+    return record
+
+
+def prometheus(extra=None):
+    """
+    Render the instance metrics in the Prometheus text format.
+
+    Parameters
+    ----------
+    extra : dict
+        Additional counters by metric name, each a dict of label value to count
+        labelled as result, e.g. emit counters.
+
+    Returns
+    -------
+    text : str
+        Metrics exposition.
+
+    """
+
+    lines = []
+
+    def histogram(name, label, histograms):
+        lines.append('# TYPE {} histogram'.format(name))
+        for key, h in sorted(histograms.items()):
+            cumulative = 0
+            for bound, n in zip(TRACE_BUCKETS + ('+Inf',), h['buckets']):
+                cumulative += n
+                lines.append('{}_bucket{{{}="{}",le="{}"}} {}'.format(name, label, key, bound, cumulative))
+            lines.append('{}_sum{{{}="{}"}} {}'.format(name, label, key, h['sum']))
+            lines.append('{}_count{{{}="{}"}} {}'.format(name, label, key, h['count']))
+
+    with metrics_lock:
+        histogram('inertia_stage_seconds', 'stage', metrics['stages'])
+        histogram('inertia_invocation_seconds', 'code', metrics['invocations'])
+        for name, n in sorted(metrics['counts'].items()):
+            lines.append('# TYPE inertia_{}_total counter'.format(name))
+            lines.append('inertia_{}_total {}'.format(name, n))
+
+    for name, counters in sorted((extra or {}).items()):
+        lines.append('# TYPE {} counter'.format(name))
+        for result, n in sorted(counters.items()):
+            lines.append('{}{{result="{}"}} {}'.format(name, result, n))
+
+    return '\n'.join(lines) + '\n'
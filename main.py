@@ -2,10 +2,20 @@
 import os
 import json
 import time
-import requests
+import functools
+import contextvars
+import concurrent.futures
 
 # project
+import helpers.body         as request_body
+import helpers.dedup        as dedup
 import helpers.general      as gen
+import helpers.model        as model
+import helpers.session      as http
+import helpers.registry     as reg
+import helpers.state        as twin_state
+import helpers.emission     as emission
+import helpers.trace        as trace
 import helpers.authenticate as auth
 
 # API interface
@@ -15,8 +25,11 @@ AUTH_ENDPOINT = os.environ.get('AUTH_ENDPOINT')
 
 # studio labels
 EMULATION_LABEL       = 'inertia-model'
+DEADBAND_LABEL        = 'inertia-deadband'
+MIN_INTERVAL_LABEL    = 'inertia-min-interval'
+METHOD_LABEL          = 'inertia-method'
 TWIN_NAME_APPENDIX    = ' twin'
-ORIGINAL_DEVICE_LABEL = 'original_device_id'
+ORIGINAL_DEVICE_LABEL = reg.ORIGINAL_DEVICE_LABEL
 
 # environment
 DT_SIGNATURE_HEADER     = "x-dt-signature"
@@ -25,10 +38,18 @@ SERVICE_ACCOUNT_EMAIL   = os.environ.get('SERVICE_ACCOUNT_EMAIL')
 SERVICE_ACCOUNT_KEY_ID  = os.environ.get('SERVICE_ACCOUNT_KEY_ID')
 SERVICE_ACCOUNT_SERCRET = os.environ.get('SERVICE_ACCOUNT_SERCRET')
 
+# twin cleanup, deletions run on a shared bounded pool within a deadline
+CLEAN_TWINS_WORKERS  = int(os.environ.get('CLEAN_TWINS_WORKERS', 8))
+CLEAN_TWINS_DEADLINE = float(os.environ.get('CLEAN_TWINS_DEADLINE', 20))
+clean_twins_pool     = None
 
-def update_emulated_twin(event, twin, coefficient, project_id, access_token):
+# requests and events answered before authentication, since cold start
+prefilter_stats = {'requests': 0, 'events': 0}
+
+
+def model_emulated_twin(event, twin, k, method=None):
     """
-    Update the modeled temperature value of the emulated twin device.
+    Calculate the new modeled temperature value of the emulated twin device.
 
     Parameters
     ----------
@@ -36,6 +57,73 @@ def update_emulated_twin(event, twin, coefficient, project_id, access_token):
         Dictionary of new event data received by HTTP GET request call.
     twin : dict
         Dictionary of emulated twin device information.
+    k : float
+        Model coefficient.
+    method : str
+        Model discretization, 'euler' or 'exact'.
+        Unknown or missing methods fall back to INERTIA_METHOD.
+
+    Returns
+    -------
+    new_value : float
+        Modeled temperature after the event.
+    event_ux : int
+        Unixtime of the event.
+
+    """
+
+    # isolate event temperature value and time
+    event_temperature = event['data']['temperature']['value']
+    _, event_ux       = gen.convert_event_data_timestamp(event['data']['temperature']['updateTime'])
+
+    # fetch previous model temperature value and time, the later of the
+    # stored state and the reported state, which may have been updated elsewhere
+    previous = twin_state.lookup(reg.device_identifier(twin))
+    if 'reported' in twin.keys() and twin['reported']['temperature'] != None:
+        _, previous_model_ux = gen.convert_event_data_timestamp(twin['reported']['temperature']['updateTime'])
+        if previous == None or previous[1] < previous_model_ux:
+            previous = (twin['reported']['temperature']['value'], previous_model_ux)
+
+    # if None, no previous events have occured, set equal to current
+    if previous == None:
+        return event_temperature, event_ux
+
+    step = model.STEPS.get(method, model.STEPS.get(model.INERTIA_METHOD, model.euler_step))
+    return step(previous[0], previous[1], event_temperature, event_ux, k), event_ux
+
+
+def record_emulated_twin(event, twin, new_value, event_ux):
+    """
+    Store an emitted value as the latest state of the emulated twin device.
+    Keeps the twin state store and the cached device index in line.
+
+    Parameters
+    ----------
+    event : dict
+        Dictionary of new event data the value was modeled from.
+    twin : dict
+        Dictionary of emulated twin device information.
+    new_value : float
+        Emitted temperature value.
+    event_ux : int
+        Unixtime of the event.
+
+    """
+
+    twin_state.record(reg.device_identifier(twin), new_value, event_ux)
+    reg.record_temperature(twin, new_value, event['data']['temperature']['updateTime'])
+
+
+def emit_value(twin_id, value, project_id, access_token):
+    """
+    Publish a modeled temperature value to an emulated twin.
+
+    Parameters
+    ----------
+    twin_id : str
+        Identifier of emulated twin.
+    value : float
+        Modeled temperature value.
     project_id : str
         Identifier of project we're interfacing with.
     access_token : str
@@ -43,8 +131,103 @@ def update_emulated_twin(event, twin, coefficient, project_id, access_token):
 
     Returns
     -------
-    status_code : tuple
-        Two-cell tuple with status message [0] and status code [1].
+    status_code : int
+        Status code of the emulator publish request.
+
+    """
+
+    emulator_emit_url = "{}/projects/{}/devices/{}:publish".format(EMU_URL_BASE, project_id, twin_id)
+    payload = json.dumps({"temperature": {"value": value}})
+    r = http.post(emulator_emit_url, access_token, data=payload, idempotent=True)
+    if r.status_code == 200:
+        emission.count_sent()
+    return int(r.status_code)
+
+
+def emission_policy(labels):
+    """
+    Read the emission policy of a twin from the labels of its original device.
+    Missing or non-float labels fall back to the global defaults.
+
+    Parameters
+    ----------
+    labels : dict
+        Dictionary of labels in new event json received from request.
+
+    Returns
+    -------
+    policy : tuple
+        Deadband [0] and minimum interval in seconds [1].
+
+    """
+
+    policy = []
+    for label, default in ((DEADBAND_LABEL, emission.EMIT_DEADBAND), (MIN_INTERVAL_LABEL, emission.EMIT_MIN_INTERVAL)):
+        try:
+            policy.append(float(labels[label]))
+        except (KeyError, ValueError, TypeError):
+            policy.append(default)
+
+    return tuple(policy)
+
+
+def coalesce_emulated_twin(event, twin, new_value, event_ux, project_id, access_token):
+    """
+    Record a modeled value and hand it to the coalescing window of the twin.
+    The model state advances with every event, the value is only published
+    now if no window is open for the twin. Values folded into a window count
+    as sent for the emission policy.
+
+    Returns
+    -------
+    publish : bool
+        True if the caller should publish new_value now.
+
+    """
+
+    record_emulated_twin(event, twin, new_value, event_ux)
+    twin_id = reg.device_identifier(twin)
+    emission.mark_sent(twin_id, new_value, event_ux)
+    emit = functools.partial(emit_value, twin_id, project_id=project_id, access_token=access_token)
+    if emission.submit(twin_id, new_value, emit):
+        return True
+
+    print('-- Coalesced new value for twin.')
+    return False
+
+
+def prepare_update(event, twin, coefficient, project_id, access_token, policy=None, method=None):
+    """
+    Model the new value of the emulated twin and decide how to publish it.
+    Shared by the sync and async update paths, up to the emit.
+
+    Parameters
+    ----------
+    event : dict
+        Dictionary of new event data received by HTTP GET request call.
+    twin : dict
+        Dictionary of emulated twin device information.
+    coefficient : str
+        Value of the emulation label of the original device.
+    project_id : str
+        Identifier of project we're interfacing with.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+    policy : tuple
+        Deadband [0] and minimum interval [1] of the twin, see emission_policy.
+        Defaults to the global emission policy.
+    method : str
+        Model discretization of the twin, see model_emulated_twin.
+
+    Returns
+    -------
+    status : tuple
+        Two-cell tuple with status message [0] and status code [1] if the
+        update is done without an emit, otherwise None.
+    update : tuple
+        Twin identifier [0], new value [1], its unixtime [2] and whether it
+        was handed to a coalescing window [3], to be emitted and passed to
+        complete_update. None if status is set.
 
     """
 
@@ -52,43 +235,101 @@ def update_emulated_twin(event, twin, coefficient, project_id, access_token):
     try:
         k = float(coefficient)
     except ValueError:
-        return ('-- non-float coefficient, skipping...', 200)
+        return ('-- non-float coefficient, skipping...', 200), None
 
-    # isolate event temperature value
-    event_temperature = event['data']['temperature']['value']
+    # calculate new model value
+    with trace.span('model'):
+        new_value, event_ux = model_emulated_twin(event, twin, k, method)
+    twin_id = reg.device_identifier(twin)
 
-    # if None, no previous events have occured, set equal to current
-    if 'reported' not in twin.keys() or twin['reported']['temperature'] == None:
-        new_value = event_temperature
-    else:
-        # fetch previous model temperature value
-        previous_model_temperature = twin['reported']['temperature']['value']
+    # advance the model without publishing values the policy suppresses
+    deadband, min_interval = policy or (None, None)
+    if not emission.admit(twin_id, new_value, event_ux, deadband, min_interval):
+        record_emulated_twin(event, twin, new_value, event_ux)
+        print('-- Suppressed new value for twin.')
+        return ('OK', 200), None
 
-        # get time since last event
-        _, previous_model_ux = gen.convert_event_data_timestamp(twin['reported']['temperature']['updateTime'])
-        _, event_ux          = gen.convert_event_data_timestamp(event['data']['temperature']['updateTime'])
+    # fold into open coalescing window
+    coalesce = emission.EMIT_COALESCE_WINDOW > 0
+    if coalesce and not coalesce_emulated_twin(event, twin, new_value, event_ux, project_id, access_token):
+        return ('OK', 200), None
 
-        # normalise by the minute
-        normaliser = (event_ux - previous_model_ux) / (60)
+    return None, (twin_id, new_value, event_ux, coalesce)
 
-        # calculate new model delta
-        dt = -k*(previous_model_temperature - event_temperature)
 
-        # set new value
-        new_value = previous_model_temperature + dt*normaliser
-        
-    # emit new value to emulated twin
-    twin_id = twin['name'].split('/')[-1]
-    emulator_emit_url = "{}/projects/{}/devices/{}:publish".format(EMU_URL_BASE, project_id, twin_id)
-    payload = json.dumps({"temperature": {"value": new_value}})
-    r = requests.post(emulator_emit_url, headers={'Authorization': access_token}, data=payload)
-    if int(r.status_code) != 200:
-        return ('ERROR: bad emit response', int(r.status_code))
+def complete_update(event, twin, update, status_code):
+    """
+    Record the outcome of emitting a value prepared by prepare_update.
+
+    Parameters
+    ----------
+    event : dict
+        Dictionary of new event data received by HTTP GET request call.
+    twin : dict
+        Dictionary of emulated twin device information.
+    update : tuple
+        Update returned by prepare_update.
+    status_code : int
+        Status code of the emit request.
+
+    Returns
+    -------
+    status : tuple
+        Two-cell tuple with status message [0] and status code [1].
+
+    """
+
+    twin_id, new_value, event_ux, coalesce = update
+    if status_code != 200:
+        return ('ERROR: bad emit response', status_code)
+
+    # keep stored and cached twin state in line with the emitted value
+    if not coalesce:
+        record_emulated_twin(event, twin, new_value, event_ux)
+        emission.mark_sent(twin_id, new_value, event_ux)
 
     print('-- Emitted new value to twin.')
     return ('OK', 200)
 
 
+def update_emulated_twin(event, twin, coefficient, project_id, access_token, policy=None, method=None):
+    """
+    Update the modeled temperature value of the emulated twin device.
+
+    Parameters
+    ----------
+    event : dict
+        Dictionary of new event data received by HTTP GET request call.
+    twin : dict
+        Dictionary of emulated twin device information.
+    project_id : str
+        Identifier of project we're interfacing with.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+    policy : tuple
+        Deadband [0] and minimum interval [1] of the twin, see emission_policy.
+        Defaults to the global emission policy.
+    method : str
+        Model discretization of the twin, see model_emulated_twin.
+
+    Returns
+    -------
+    status_code : tuple
+        Two-cell tuple with status message [0] and status code [1].
+
+    """
+
+    status, update = prepare_update(event, twin, coefficient, project_id, access_token, policy, method)
+    if status != None:
+        return status
+
+    # emit new value to emulated twin
+    with trace.span('emit'):
+        status_code = emit_value(update[0], update[1], project_id, access_token)
+
+    return complete_update(event, twin, update, status_code)
+
+
 def get_device_name(device):
     """
     Find the name of a device fetched from the project device list.
@@ -110,10 +351,10 @@ def get_device_name(device):
     if 'name' in device['labels'].keys():
         return device['labels']['name']
     else:
-        return device['name'].split('/')[-1]
+        return reg.device_identifier(device)
 
 
-def find_twin(device_id, device_list):
+def find_twin(device_id, device_index):
     """
     Locate the emulated twin of source device with identifier device_id.
 
@@ -121,8 +362,9 @@ def find_twin(device_id, device_list):
     ----------
     device_id : str
         Identifier of original device for which the twin is located.
-    device_list : list
-        List of device dictionaries in project fetched by the API.
+    device_index : dict or iterable
+        Index of project devices, see helpers.registry.build_index.
+        An iterable of device dictionaries is scanned until the twin is found.
 
     Returns
     -------
@@ -132,66 +374,183 @@ def find_twin(device_id, device_list):
 
     """
 
-    # iterate devices
-    for device in device_list:
-        # skip non-emulated devices
-        if not device['name'].split('/')[-1].startswith('emu'):
-            continue
-
-        # check if device_id label exists and matches
-        if 'original_device_id' in device['labels'].keys() and device['labels']['original_device_id'] == device_id:
-            print('-- Located twin [{}].'.format(device['labels']['name']))
-            return device
+    # scan device iterable, stopping at first match
+    if not isinstance(device_index, dict):
+        for device in device_index:
+            # skip non-emulated devices
+            if not reg.device_identifier(device).startswith(reg.EMULATED_PREFIX):
+                continue
+
+            # check if device_id label exists and matches
+            if device['labels'].get(ORIGINAL_DEVICE_LABEL) == device_id:
+                print('-- Located twin [{}].'.format(device['labels']['name']))
+                return device
+        return None
+
+    # look up twins indexed by original device
+    twins = device_index['twins'].get(device_id)
+    if twins:
+        device = next(iter(twins.values()))
+        print('-- Located twin [{}].'.format(device['labels']['name']))
+        return device
 
     # no twin found
     return None
 
 
-def clean_twins(device_id, device_list, project_id, access_token):
+def delete_twin(delete_id, project_id, access_token, timeout):
+    """
+    Delete a single emulated twin.
+
+    Parameters
+    ----------
+    delete_id : str
+        Identifier of emulated twin to be deleted.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+    timeout : float
+        Seconds to wait for the emulator.
+
+    Returns
+    -------
+    status_code : int
+        Status code of DELETE request.
+
+    """
+
+    emulator_delete_url = "{}/projects/{}/devices/{}".format(EMU_URL_BASE, project_id, delete_id)
+    return http.delete(emulator_delete_url, access_token, timeout=timeout).status_code
+
+
+def summarize_clean(twins, results, device_index):
+    """
+    Drop deleted twins from the index and summarize a cleanup.
+
+    Parameters
+    ----------
+    twins : list
+        List of (identifier, device) tuples of twins to be deleted.
+    results : dict
+        Status code of DELETE request per twin identifier, None on errors.
+        Twins without result timed out.
+    device_index : dict
+        Index of project devices, see helpers.registry.build_index.
+
+    Returns
+    -------
+    summary : dict
+        Identifiers of twins that were deleted, failed or timed out.
+
+    """
+
+    summary = {'deleted': [], 'failed': [], 'timed_out': []}
+    # update index and aggregate results
+    for delete_id, device in twins:
+        if delete_id not in results:
+            summary['timed_out'].append(delete_id)
+        elif results[delete_id] == 200:
+            reg.remove_device(device_index, delete_id)
+            summary['deleted'].append(delete_id)
+            print('-- deleted twin: {}'.format(device['labels']['name']))
+        else:
+            summary['failed'].append(delete_id)
+            print('WARNING: could not delete twin: {}'.format(delete_id))
+
+    if len(twins) > 0:
+        print('-- Cleaned twins: {} deleted, {} failed, {} timed out.'.format(
+            len(summary['deleted']), len(summary['failed']), len(summary['timed_out'])))
+    return summary
+
+
+def clean_twins(device_id, device_index, project_id, access_token, deadline=None):
     """
     Remove any emulated twins related to original device with identifier device_id.
+    Deletions are sent concurrently from a pool of CLEAN_TWINS_WORKERS threads.
 
     Parameters
     ----------
     device_id : str
         Identifier of original device for which twins are cleaned.
-    device_list : list
-        List of project device dictionaries fetched by the API.
+    device_index : dict
+        Index of project devices, see helpers.registry.build_index.
     project_id : str
         Identifier of the project we're interfacing with.
     access_token : str
         Acces token received from DT authentication endpoint.
+    deadline : float
+        Seconds to wait for all deletions. Defaults to CLEAN_TWINS_DEADLINE.
 
     Returns
     -------
-    status : tuple
-        Tuple with 2 cells containing status text [0] and status code [1].
+    summary : dict
+        Identifiers of twins that were deleted, failed or timed out.
 
     """
 
-    # iterate devices
-    for device in device_list:
-        # skip non-emulated devices
-        if not device['name'].split('/')[-1].startswith('emu'):
-            continue
+    global clean_twins_pool
 
-        # check if device_id label exists
-        if 'original_device_id' in device['labels'].keys() and device['labels']['original_device_id'] == device_id:
-            # isolate id of device to be deleted
-            delete_id = device['name'].split('/')[-1]
+    twins = list(device_index['twins'].get(device_id, {}).items())
+    if len(twins) == 0:
+        return summarize_clean(twins, {}, device_index)
 
-            # send delete request
-            emulator_delete_url = "{}/projects/{}/devices/{}".format(EMU_URL_BASE, project_id, delete_id)
-            r = requests.delete(emulator_delete_url, headers={'Authorization': access_token})
+    if deadline == None:
+        deadline = CLEAN_TWINS_DEADLINE
+    timeout = min(http.HTTP_TIMEOUT, deadline)
 
-            # verify deletion
-            if r.status_code == 200:
-                print('-- deleted twin: {}'.format(device['labels']['name']))
-            else:
-                print('WARNING: could not delete twin: {}'.format(device_id))
+    # single twin, no need for the pool
+    if len(twins) == 1:
+        try:
+            results = {twins[0][0]: delete_twin(twins[0][0], project_id, access_token, timeout)}
+        except Exception:
+            results = {twins[0][0]: None}
+
+    # dispatch deletions to the shared pool and wait until the deadline
+    else:
+        if clean_twins_pool == None:
+            clean_twins_pool = concurrent.futures.ThreadPoolExecutor(max_workers=CLEAN_TWINS_WORKERS)
+        # deletions count towards the trace of this invocation
+        futures = {clean_twins_pool.submit(contextvars.copy_context().run, delete_twin,
+                                           delete_id, project_id, access_token, timeout): delete_id
+                   for delete_id, _ in twins}
+        done, _ = concurrent.futures.wait(futures, timeout=deadline)
+        results = {futures[f]: (f.result() if f.exception() == None else None) for f in done}
+
+    return summarize_clean(twins, results, device_index)
 
 
-def spawn_twin(device_id, original_name, project_id, access_token):
+def recheck_twin(device_id, device_index, project_id, access_token):
+    """
+    Ask the API for twins of a device missing from the device index.
+    Another instance may have spawned one since the index was built, so
+    this runs before spawning.
+
+    Parameters
+    ----------
+    device_id : str
+        Identifier of original device.
+    device_index : dict
+        Index of project devices, see helpers.registry.build_index.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+
+    Returns
+    -------
+    twin : dict
+        Dictionary of a twin found by the API, None if there is none.
+
+    """
+
+    for twin in reg.fetch_twins(API_URL_BASE, project_id, device_id, access_token):
+        reg.index_device(device_index, twin)
+
+    return find_twin(device_id, device_index)
+
+
+def spawn_twin(device_id, original_name, device_index, project_id, access_token):
     """
     Spawn new emulated twin for original device with identifier device_id.
 
@@ -201,6 +560,8 @@ def spawn_twin(device_id, original_name, project_id, access_token):
         Identifier of original device for which twins are cleaned.
     original_name : str
         Given name or identifier of original device.
+    device_index : dict
+        Index of project devices, see helpers.registry.build_index.
     project_id : str
         Identifier of the project we're interfacing with.
     access_token : str
@@ -224,15 +585,17 @@ def spawn_twin(device_id, original_name, project_id, access_token):
             ORIGINAL_DEVICE_LABEL: device_id,
         }
     })
-    r = requests.post(emulator_emit_url, headers={'Authorization': access_token}, data=payload)
+    r = http.post(emulator_emit_url, access_token, data=payload)
+    twin = r.json()
 
     if r.status_code == 200:
+        reg.index_device(device_index, twin)
         print('-- Spawned twin [{}].'.format(twin_name))
 
-    return r.status_code, r.json()
+    return r.status_code, twin
 
 
-def find_original_device(device_id, device_list):
+def find_original_device(device_id, device_index):
     """
     Locate the dictionary of original device in list fetched by API.
 
@@ -240,8 +603,9 @@ def find_original_device(device_id, device_list):
     ----------
     device_id : str
         Identifier of original device we're looking for.
-    device_list : list
-        List of project device dictionaries fetched by API.
+    device_index : dict or iterable
+        Index of project devices, see helpers.registry.build_index.
+        An iterable of device dictionaries is scanned until the device is found.
 
     Returns
     -------
@@ -251,15 +615,15 @@ def find_original_device(device_id, device_list):
 
     """
 
-    # iterate devices
-    for device in device_list:
-        # match id
-        if device_id == device['name'].split('/')[-1]:
-            # found it
-            return device
+    # scan device iterable, stopping at first match
+    if not isinstance(device_index, dict):
+        for device in device_index:
+            if reg.device_identifier(device) == device_id:
+                return device
+        return None
 
-    # no device found
-    return None
+    # look up device by identifier, None if not found
+    return device_index['devices'].get(device_id)
 
 
 def refresh_twin_name(twin, new_prefix, project_id, access_token):
@@ -280,17 +644,20 @@ def refresh_twin_name(twin, new_prefix, project_id, access_token):
     """
 
     # emit new value to emulated twin
-    twin_id = twin['name'].split('/')[-1]
+    twin_id = reg.device_identifier(twin)
     emulator_emit_url = "{}/projects/{}/devices/{}/labels/name?updateMask=value".format(API_URL_BASE, project_id, twin_id)
     payload = json.dumps({'value': new_prefix + TWIN_NAME_APPENDIX})
-    r = requests.patch(emulator_emit_url, headers={'Authorization': access_token}, data=payload)
+    r = http.patch(emulator_emit_url, access_token, data=payload)
     if r.status_code == 200:
         print('-- Twin name refresh: {} -> {}.'.format(twin['labels']['name'], new_prefix + TWIN_NAME_APPENDIX))
+
+        # patch indexed twin in place
+        twin['labels']['name'] = new_prefix + TWIN_NAME_APPENDIX
     else:
         print('-- WARNING: Could not change name.')
 
 
-def synchronize_emulated_twin(event, labels, device_id, device_list, project_id, access_token):
+def synchronize_emulated_twin(event, labels, device_id, device_index, project_id, access_token):
     """
     event : dict
         Dictionary form of new event json received from request.
@@ -298,8 +665,8 @@ def synchronize_emulated_twin(event, labels, device_id, device_list, project_id,
         Dictionary of labels in new event json received from request.
     device_id : str
         Identifier of target device for new event.
-    device_list : list
-        List of project device dictionaries fetched by API.
+    device_index : dict
+        Index of project devices, see helpers.registry.build_index.
     project_id : str
         Identifier of the project we're interfacing with.
     access_token : str
@@ -332,27 +699,31 @@ def synchronize_emulated_twin(event, labels, device_id, device_list, project_id,
         # removed label
         elif EMULATION_LABEL in event['data']['removed']:
             # remove any emulated devices associated with event source device
-            clean_twins(device_id, device_list, project_id, access_token)
+            clean_twins(device_id, device_index, project_id, access_token)
             return ('-- Removed emulation label.', 200), None
 
     if EMULATION_LABEL in labels.keys() or new_spawn:
         # find twin if it exists
-        twin = find_twin(device_id, device_list)
+        twin = find_twin(device_id, device_index)
     
-        # locate original device in device_list
-        original_device = find_original_device(device_id, device_list)
+        # locate original device in device_index
+        original_device = find_original_device(device_id, device_index)
     
         # verify that we found original device in device list
         if original_device == None: 
             return ('could not find original device', 400), None
     
+        # twins spawned elsewhere since the index was built
+        if twin == None:
+            twin = recheck_twin(device_id, device_index, project_id, access_token)
+
         # if it wasn't found (None), spawn it
         if twin == None:
             # cleanup existing twins
-            clean_twins(device_id, device_list, project_id, access_token)
+            clean_twins(device_id, device_index, project_id, access_token)
     
             # spawn new twin
-            spawn_status, twin = spawn_twin(device_id, get_device_name(original_device), project_id, access_token)
+            spawn_status, twin = spawn_twin(device_id, get_device_name(original_device), device_index, project_id, access_token)
     
             # verify good spawn
             if spawn_status != 200:
@@ -368,11 +739,217 @@ def synchronize_emulated_twin(event, labels, device_id, device_list, project_id,
     
     else:
         # remove any emulated devices associated with event source device
-        clean_twins(device_id, device_list, project_id, access_token)
+        clean_twins(device_id, device_index, project_id, access_token)
         return ('no emulation label', 200), None
 
 
-def api_interface(event, labels, access_token):
+def project_index(project_id, access_token):
+    """
+    Get the index of project devices events are resolved against.
+
+    Parameters
+    ----------
+    project_id : str
+        Identifier of the project we're interfacing with.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+
+    Returns
+    -------
+    device_index : dict
+        Cached project index, or an empty index filled per event if the
+        registry is disabled.
+
+    """
+
+    if reg.DEVICE_REGISTRY_TTL > 0:
+        return reg.get_index(API_URL_BASE, project_id, access_token)
+    return reg.build_index([])
+
+
+def index_event_device(event, project_id, device_id, access_token, device_index=None):
+    """
+    Make sure the device of an event and its twins are in a device index.
+    Applies label changes and looks up devices unknown to the index.
+
+    Parameters
+    ----------
+    event : dict
+        Dictionary form of new event json received from request.
+    project_id : str
+        Identifier of the project we're interfacing with.
+    device_id : str
+        Identifier of target device for new event.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+    device_index : dict
+        Index shared between events, e.g. in a batch.
+        Defaults to project_index.
+
+    Returns
+    -------
+    device_index : dict
+        Index of project devices, see helpers.registry.build_index.
+
+    """
+
+    # get index of project devices
+    if device_index == None:
+        device_index = project_index(project_id, access_token)
+
+    # patch index with label changes, look up devices unknown to it
+    if event['eventType'] == 'labelsChanged':
+        if not reg.apply_labels_changed(device_index, device_id, event['data']):
+            reg.merge_index(device_index, reg.lookup_index(API_URL_BASE, project_id, device_id, access_token))
+    elif device_id not in device_index['devices']:
+        reg.merge_index(device_index, reg.lookup_index(API_URL_BASE, project_id, device_id, access_token))
+
+    return device_index
+
+
+def well_formed_event(item):
+    """
+    Check that a request item has the shape of a single event.
+
+    Parameters
+    ----------
+    item : object
+        Parsed request body, or an item of a batch.
+
+    Returns
+    -------
+    valid : bool
+        True for a dict with labels and an event with eventType and targetName.
+
+    """
+
+    if not isinstance(item, dict) or not isinstance(item.get('labels'), dict):
+        return False
+
+    event = item.get('event')
+    return isinstance(event, dict) and isinstance(event.get('eventType'), str) \
+        and isinstance(event.get('targetName'), str)
+
+
+def well_formed(body):
+    """
+    Check that a parsed body has the shape of a single event or a batch.
+    Items of batches are checked per event by batch_interface.
+
+    Parameters
+    ----------
+    body : object
+        Parsed request body.
+
+    Returns
+    -------
+    valid : bool
+        True for a list or a well formed single event.
+
+    """
+
+    return isinstance(body, list) or well_formed_event(body)
+
+
+def event_identifier(item):
+    """
+    Identifier of the event in a request body or batch item.
+
+    Parameters
+    ----------
+    item : dict
+        Dictionary with event and labels, as received from request.
+
+    Returns
+    -------
+    event_id : str
+        The eventId of the event, None if it has none.
+
+    """
+
+    try:
+        return item['event'].get('eventId')
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+def prefilter(item):
+    """
+    Decide from the request body alone whether an event can cause work.
+    Only the cached device index is consulted, nothing is fetched.
+
+    Parameters
+    ----------
+    item : dict
+        Dictionary with event and labels, as received from request.
+
+    Returns
+    -------
+    status : tuple
+        Tuple with 2 cells containing status text [0] and status code [1]
+        if the event can be skipped. Returns None if it must be processed.
+
+    """
+
+    try:
+        event_type = item['event']['eventType']
+        labels     = item['labels']
+        target     = item['event']['targetName'].split('/')
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+    # skip non-temperature events
+    if event_type != 'temperature' and event_type != 'labelsChanged':
+        return ('skipped event type {}'.format(event_type), 200)
+
+    # skip unlabelled sensors known to have no twins to clean up
+    if event_type == 'temperature' and EMULATION_LABEL not in labels:
+        device_index = reg.cached_index(target[1]) if len(target) > 1 else None
+        if device_index != None and target[-1] in device_index['devices'] \
+                and not device_index['twins'].get(target[-1]):
+            return ('no emulation label', 200)
+
+    return None
+
+
+def prefilter_request(body):
+    """
+    Pre-filter a request body before authentication.
+
+    Parameters
+    ----------
+    body : object
+        Parsed request body, a dict for single events and a list for batches.
+
+    Returns
+    -------
+    status : tuple
+        Tuple with 2 cells containing status text [0] and status code [1]
+        if no event of the request can cause work, otherwise None.
+    skips : list
+        Status of each batch event skipped by prefilter, None for events to
+        process. None for single events.
+
+    """
+
+    if not isinstance(body, list):
+        status = prefilter(body)
+        if status != None:
+            prefilter_stats['requests'] += 1
+            prefilter_stats['events'] += 1
+        return status, None
+
+    skips = [prefilter(item) for item in body]
+    skipped = sum(skip != None for skip in skips)
+    prefilter_stats['events'] += skipped
+    if skipped < len(skips):
+        return None, skips
+
+    prefilter_stats['requests'] += 1
+    return batch_response(skips), skips
+
+
+def api_interface(event, labels, access_token, device_index=None):
     """
     Talk to API to calculate new model value.
     Filters events and defines the order of action.
@@ -386,6 +963,9 @@ def api_interface(event, labels, access_token):
         Dictionary of labels in new event json received from request.
     access_token : str
         Acces token received from DT authentication endpoint.
+    device_index : dict
+        Index of project devices shared between events, e.g. in a batch.
+        Defaults to project_index.
 
     Returns
     -------
@@ -402,14 +982,15 @@ def api_interface(event, labels, access_token):
     # if EMULATION_LABEL not in labels.keys() and event['eventType'] != 'labelsChanged':
     #     return ('no emulation', 200)
 
-    # request project devices list
-    project_id       = event['targetName'].split('/')[1]
-    devices_list_url = "{}/projects/{}/devices".format(API_URL_BASE, project_id)
-    device_list      = requests.get(devices_list_url, headers={'Authorization': access_token}).json()['devices']
-    device_id        = event['targetName'].split('/')[-1]
+    # get index of project devices
+    project_id   = event['targetName'].split('/')[1]
+    device_id    = event['targetName'].split('/')[-1]
+    with trace.span('index'):
+        device_index = index_event_device(event, project_id, device_id, access_token, device_index)
 
     # synchronize
-    status, twin = synchronize_emulated_twin(event, labels, device_id, device_list, project_id, access_token)
+    with trace.span('synchronize'):
+        status, twin = synchronize_emulated_twin(event, labels, device_id, device_index, project_id, access_token)
 
     # verify status
     if status[1] != 200 or twin == None:
@@ -420,13 +1001,114 @@ def api_interface(event, labels, access_token):
         return ('OK', 200)
 
     # calculate model delta T
-    status = update_emulated_twin(event, twin, labels[EMULATION_LABEL], project_id, access_token)
+    status = update_emulated_twin(event, twin, labels[EMULATION_LABEL], project_id, access_token,
+                                  emission_policy(labels), labels.get(METHOD_LABEL))
+
+    # twin was deleted since it was indexed, forget it and spawn a new one
+    if status[1] == 404:
+        print('-- Twin no longer exists, respawning.')
+        reg.remove_device(device_index, reg.device_identifier(twin))
+        status, twin = synchronize_emulated_twin(event, labels, device_id, device_index, project_id, access_token)
+        if status[1] == 200 and twin != None:
+            status = update_emulated_twin(event, twin, labels[EMULATION_LABEL], project_id, access_token,
+                                          emission_policy(labels), labels.get(METHOD_LABEL))
     if status[1] != 200:
         return status
     
     return ('OK', 200)
 
 
+def batch_response(statuses):
+    """
+    Combine per-event statuses into the status of a batch request.
+    A batch with events that failed in a way worth retrying answers with
+    the highest such code, so the Data Connector retries it. Events that
+    succeeded are skipped on the retry by event deduplication.
+
+    Parameters
+    ----------
+    statuses : list
+        Tuples with status text [0] and status code [1] per event.
+
+    Returns
+    -------
+    status : tuple
+        Tuple with 2 cells containing a json list of per-event statuses [0]
+        and status code [1].
+
+    """
+
+    retryable = [code for _, code in statuses if code >= 500 or code == 429]
+    body = json.dumps([{'status': text, 'code': code} for text, code in statuses])
+
+    return (body, max(retryable) if retryable else 200)
+
+
+def batch_interface(items, access_token, statuses=None):
+    """
+    Talk to API for a batch of events.
+    Events are grouped by project and device, keeping their order per device,
+    and share one device index per project.
+
+    Parameters
+    ----------
+    items : list
+        List of dictionaries with event and labels, as in single requests.
+    access_token : str
+        Acces token received from DT authentication endpoint.
+    statuses : list
+        Statuses of events already answered, e.g. by prefilter_request,
+        None for events to process. Defaults to processing all events.
+
+    Returns
+    -------
+    status : tuple
+        Tuple with 2 cells containing a json list of per-event statuses [0]
+        and status code [1].
+
+    """
+
+    statuses = list(statuses) if statuses != None else [None] * len(items)
+
+    # group events by project and device
+    groups = {}
+    for i, item in enumerate(items):
+        if statuses[i] != None:
+            continue
+        target = item['event']['targetName'].split('/') if well_formed_event(item) else []
+        if len(target) < 2:
+            statuses[i] = ('malformed event', 400)
+            continue
+        groups.setdefault((target[1], target[-1]), []).append(i)
+
+    # process each device in order, sharing one index per project
+    indexes = {}
+    for (project_id, device_id), group in groups.items():
+        for i in group:
+            # skip events processed by an earlier delivery
+            if dedup.seen(event_identifier(items[i])):
+                statuses[i] = ('duplicate event', 200)
+                continue
+            try:
+                if project_id not in indexes:
+                    with trace.span('index'):
+                        indexes[project_id] = project_index(project_id, access_token)
+                statuses[i] = api_interface(items[i]['event'], items[i]['labels'], access_token,
+                                            indexes[project_id])
+                if statuses[i][1] == 200:
+                    dedup.mark(event_identifier(items[i]))
+            except http.CircuitOpenError as e:
+                statuses[i] = ('ERROR: {}'.format(e), 503)
+            except Exception as e:
+                statuses[i] = ('ERROR: {}'.format(e), 500)
+
+    # publish values held back during the batch
+    emission.flush(force=True)
+
+    print('-- Processed batch of {} events.'.format(len(items)))
+    return batch_response(statuses)
+
+
 def terminate(status, dt):
     """
     Called for terminating execution.
@@ -448,6 +1130,10 @@ def terminate(status, dt):
     """
 
     # console out
+    trace.finish(status)
+    print('-- Emits since cold start: {sent} sent, {suppressed} suppressed, {coalesced} coalesced.'.format(**emission.emit_stats))
+    print('-- Events since cold start: {duplicates} duplicates skipped, {marked} marked processed.'.format(**dedup.dedup_stats))
+    print('-- Pre-filtered since cold start: {requests} requests, {events} events.'.format(**prefilter_stats))
     print('-- Execution ended at {:.3f}s with status {}.'.format(dt, status))
     print('END' + '-'*50)
 
@@ -474,27 +1160,78 @@ def main(request):
     """
 
     # time the execution
-    start = time.time()
+    start = time.perf_counter()
+    trace.start()
+    http.start_deadline()
 
     # logging frame start
     print('START' + '-'*50)
 
+    # publish values of expired coalescing windows
+    emission.flush()
+
+    # read body once, hashed while it is read
+    try:
+        data, checksum = request_body.read(request)
+    except request_body.BodyTooLarge as e:
+        return terminate(('ERROR: {}'.format(e), 413), time.perf_counter()-start)
+
     # validate secret etc
-    status = auth.project_validate(request, DT_SIGNATURE_HEADER, DT_SIGNATURE_SECRET)
+    with trace.span('validate'):
+        status = auth.project_validate(request, DT_SIGNATURE_HEADER, DT_SIGNATURE_SECRET, checksum)
     if status[1] != 200:
-        return terminate(status, time.time()-start)
-
-    # authenticate to service account
-    access_token = auth.authenticate_service_account(SERVICE_ACCOUNT_EMAIL,
-                                                     SERVICE_ACCOUNT_KEY_ID,
-                                                     SERVICE_ACCOUNT_SERCRET,
-                                                     AUTH_ENDPOINT)
-    if access_token == None:
-        return terminate(('Not Authenticated', 401), time.time()-start)
+        return terminate(status, time.perf_counter()-start)
 
-    # talk to api
-    status = api_interface(request.get_json()['event'], request.get_json()['labels'], access_token)
+    # parse the validated body, handed through the pipeline from here
+    try:
+        body = request_body.parse(data)
+    except ValueError:
+        return terminate(('malformed body', 400), time.perf_counter()-start)
+    if not well_formed(body):
+        return terminate(('malformed body', 400), time.perf_counter()-start)
+
+    # answer retried events without touching the API
+    if isinstance(body, dict) and dedup.seen(event_identifier(body)):
+        return terminate(('duplicate event', 200), time.perf_counter()-start)
+
+    # answer events that cannot cause work without authenticating
+    status, skips = prefilter_request(body)
+    if status != None:
+        return terminate(status, time.perf_counter()-start)
+
+    # short-circuit re-delivered requests before any API work
+    replay = auth.claim_request(checksum)
+    if replay == 'done':
+        return terminate(('duplicate request', 200), time.perf_counter()-start)
+    if replay == 'pending':
+        return terminate(('duplicate request in progress', 409), time.perf_counter()-start)
+
+    # release the claim unless processed successfully, so retries go through
+    status = None
+    try:
+        # authenticate to service account, reusing token across warm invocations
+        with trace.span('token'):
+            access_token = auth.cached_service_account_token(SERVICE_ACCOUNT_EMAIL,
+                                                             SERVICE_ACCOUNT_KEY_ID,
+                                                             SERVICE_ACCOUNT_SERCRET,
+                                                             AUTH_ENDPOINT)
+        if access_token == None:
+            status = ('Not Authenticated', 401)
+
+        # talk to api, once per event in batch requests
+        elif isinstance(body, list):
+            status = batch_interface(body, access_token, skips)
+        else:
+            status = api_interface(body['event'], body['labels'], access_token)
+            if status[1] == 200:
+                dedup.mark(event_identifier(body))
+    except http.CircuitOpenError as e:
+        status = ('ERROR: {}'.format(e), 503)
+    except http.transport_errors() as e:
+        status = ('ERROR: {}'.format(str(e) or type(e).__name__), 504 if http.is_timeout(e) else 503)
+    finally:
+        auth.settle_request(checksum, status != None and status[1] == 200)
 
     # success
-    return terminate(status, time.time()-start)
+    return terminate(status, time.perf_counter()-start)
 
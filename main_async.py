@@ -0,0 +1,485 @@
+# packages
+import json
+import time
+import asyncio
+import functools
+import contextvars
+
+# project
+import main
+import helpers.body          as request_body
+import helpers.dedup         as dedup
+import helpers.registry      as reg
+import helpers.session       as http
+import helpers.session_async as ahttp
+import helpers.emission      as emission
+import helpers.trace         as trace
+import helpers.authenticate  as auth
+
+
+async def run_sync(func, *args):
+    """
+    Run a blocking function in the default executor.
+    Used for rare calls, like token and device list refreshes, that stay
+    on the synchronous session. Runs in a copy of the current context, so
+    its calls count towards the trace of the invocation.
+
+    """
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+
+async def emit_value(twin_id, value, project_id, access_token):
+    """
+    Async version of main.emit_value.
+
+    """
+
+    emulator_emit_url = "{}/projects/{}/devices/{}:publish".format(main.EMU_URL_BASE, project_id, twin_id)
+    payload = json.dumps({"temperature": {"value": value}})
+    r = await ahttp.post(emulator_emit_url, access_token, data=payload, idempotent=True)
+    if r.status_code == 200:
+        emission.count_sent()
+    return int(r.status_code)
+
+
+async def update_emulated_twin(event, twin, coefficient, project_id, access_token, policy=None, method=None):
+    """
+    Async version of main.update_emulated_twin.
+    Values held back in coalescing windows are published from their timer.
+
+    """
+
+    status, update = main.prepare_update(event, twin, coefficient, project_id, access_token, policy, method)
+    if status != None:
+        return status
+
+    # emit new value to emulated twin
+    with trace.span('emit'):
+        status_code = await emit_value(update[0], update[1], project_id, access_token)
+
+    return main.complete_update(event, twin, update, status_code)
+
+
+async def delete_twin(delete_id, project_id, access_token, timeout):
+    """
+    Async version of main.delete_twin.
+
+    """
+
+    emulator_delete_url = "{}/projects/{}/devices/{}".format(main.EMU_URL_BASE, project_id, delete_id)
+    return (await ahttp.delete(emulator_delete_url, access_token, timeout=timeout)).status_code
+
+
+async def clean_twins(device_id, device_index, project_id, access_token, deadline=None):
+    """
+    Async version of main.clean_twins.
+    At most CLEAN_TWINS_WORKERS deletions are in flight at once.
+
+    """
+
+    twins = list(device_index['twins'].get(device_id, {}).items())
+    if len(twins) == 0:
+        return main.summarize_clean(twins, {}, device_index)
+
+    if deadline == None:
+        deadline = main.CLEAN_TWINS_DEADLINE
+    timeout = min(http.HTTP_TIMEOUT, deadline)
+    semaphore = asyncio.Semaphore(main.CLEAN_TWINS_WORKERS)
+
+    async def bounded_delete(delete_id):
+        async with semaphore:
+            return await delete_twin(delete_id, project_id, access_token, timeout)
+
+    # dispatch deletions and wait until the deadline
+    tasks = {asyncio.ensure_future(bounded_delete(delete_id)): delete_id for delete_id, _ in twins}
+    done, pending = await asyncio.wait(list(tasks), timeout=deadline)
+    for task in pending:
+        task.cancel()
+    results = {tasks[t]: (t.result() if t.exception() == None else None) for t in done}
+
+    return main.summarize_clean(twins, results, device_index)
+
+
+async def spawn_twin(device_id, original_name, device_index, project_id, access_token):
+    """
+    Async version of main.spawn_twin.
+
+    """
+
+    twin_name = original_name + main.TWIN_NAME_APPENDIX
+    emulator_emit_url = "{}/projects/{}/devices".format(main.EMU_URL_BASE, project_id)
+    payload = json.dumps({
+        'type': 'temperature',
+        'labels': {
+            'name': twin_name,
+            main.ORIGINAL_DEVICE_LABEL: device_id,
+        }
+    })
+    r = await ahttp.post(emulator_emit_url, access_token, data=payload)
+    twin = r.json()
+
+    if r.status_code == 200:
+        reg.index_device(device_index, twin)
+        print('-- Spawned twin [{}].'.format(twin_name))
+
+    return r.status_code, twin
+
+
+async def refresh_twin_name(twin, new_prefix, project_id, access_token):
+    """
+    Async version of main.refresh_twin_name.
+
+    """
+
+    twin_id = reg.device_identifier(twin)
+    emulator_emit_url = "{}/projects/{}/devices/{}/labels/name?updateMask=value".format(main.API_URL_BASE, project_id, twin_id)
+    payload = json.dumps({'value': new_prefix + main.TWIN_NAME_APPENDIX})
+    r = await ahttp.patch(emulator_emit_url, access_token, data=payload)
+    if r.status_code == 200:
+        print('-- Twin name refresh: {} -> {}.'.format(twin['labels']['name'], new_prefix + main.TWIN_NAME_APPENDIX))
+
+        # patch indexed twin in place
+        twin['labels']['name'] = new_prefix + main.TWIN_NAME_APPENDIX
+    else:
+        print('-- WARNING: Could not change name.')
+
+
+async def synchronize_emulated_twin(event, labels, device_id, device_index, project_id, access_token):
+    """
+    Async version of main.synchronize_emulated_twin.
+    A needed twin rename is not awaited but returned as a pending task, so
+    it can run concurrently with the value emit.
+
+    Returns
+    -------
+    status : tuple
+        Tuple with 2 cells containing status text [0] and status code [1].
+    twin : dict
+        Dictionary of emulated twin for target device in event.
+    pending : list
+        Tasks still running, to be awaited by the caller.
+
+    """
+
+    # initialise some helper variables
+    twin = None
+    new_spawn = False
+    pending = []
+
+    # check for labelsChanged event
+    if event['eventType'] == 'labelsChanged':
+        # new label
+        if main.EMULATION_LABEL in event['data']['added'].keys():
+            new_spawn = True
+            print('-- New emulation label.')
+
+        # modified label
+        elif main.EMULATION_LABEL in event['data']['modified'].keys():
+            return ('-- Modified emulation label.', 200), None, pending
+
+        # removed label
+        elif main.EMULATION_LABEL in event['data']['removed']:
+            # remove any emulated devices associated with event source device
+            await clean_twins(device_id, device_index, project_id, access_token)
+            return ('-- Removed emulation label.', 200), None, pending
+
+    if main.EMULATION_LABEL in labels.keys() or new_spawn:
+        # find twin and original device
+        twin = main.find_twin(device_id, device_index)
+        original_device = main.find_original_device(device_id, device_index)
+
+        # verify that we found original device in device list
+        if original_device == None:
+            return ('could not find original device', 400), None, pending
+
+        # twins spawned elsewhere since the index was built
+        if twin == None:
+            twin = await run_sync(main.recheck_twin, device_id, device_index, project_id, access_token)
+
+        # if it wasn't found (None), clean up and spawn it
+        if twin == None:
+            await clean_twins(device_id, device_index, project_id, access_token)
+            spawn_status, twin = await spawn_twin(device_id, main.get_device_name(original_device), device_index, project_id, access_token)
+
+            # verify good spawn
+            if spawn_status != 200:
+                return ('ERROR: could not spawn twin', 400), None, pending
+
+        # refresh twin name in the background
+        if not main.get_device_name(twin).startswith(main.get_device_name(original_device)):
+            pending.append(asyncio.ensure_future(
+                refresh_twin_name(twin, main.get_device_name(original_device), project_id, access_token)
+            ))
+
+        print('-- Synchronized with twin.')
+        return ('OK', 200), twin, pending
+
+    else:
+        # remove any emulated devices associated with event source device
+        await clean_twins(device_id, device_index, project_id, access_token)
+        return ('no emulation label', 200), None, pending
+
+
+async def api_interface(event, labels, access_token, device_index=None):
+    """
+    Async version of main.api_interface.
+    Device index lookups stay synchronous and run in the executor.
+
+    """
+
+    # skip non-temperature events
+    if event['eventType'] != 'temperature' and event['eventType'] != 'labelsChanged':
+        return ('skipped event type {}'.format(event['eventType']), 200)
+
+    # get index of project devices
+    project_id   = event['targetName'].split('/')[1]
+    device_id    = event['targetName'].split('/')[-1]
+    with trace.span('index'):
+        device_index = await run_sync(main.index_event_device, event, project_id, device_id, access_token, device_index)
+
+    # synchronize
+    with trace.span('synchronize'):
+        status, twin, pending = await synchronize_emulated_twin(event, labels, device_id, device_index, project_id, access_token)
+
+    # verify status
+    if status[1] != 200 or twin == None:
+        await asyncio.gather(*pending)
+        return status
+
+    # stop here if labelchange event
+    if event['eventType'] == 'labelsChanged':
+        await asyncio.gather(*pending)
+        return ('OK', 200)
+
+    # emit new value while the twin is renamed
+    results = await asyncio.gather(update_emulated_twin(event, twin, labels[main.EMULATION_LABEL], project_id, access_token,
+                                                        main.emission_policy(labels), labels.get(main.METHOD_LABEL)),
+                                   *pending)
+    status = results[0]
+
+    # twin was deleted since it was indexed, forget it and spawn a new one
+    if status[1] == 404:
+        print('-- Twin no longer exists, respawning.')
+        reg.remove_device(device_index, reg.device_identifier(twin))
+        status, twin, pending = await synchronize_emulated_twin(event, labels, device_id, device_index, project_id, access_token)
+        await asyncio.gather(*pending)
+        if status[1] == 200 and twin != None:
+            status = await update_emulated_twin(event, twin, labels[main.EMULATION_LABEL], project_id, access_token,
+                                                main.emission_policy(labels), labels.get(main.METHOD_LABEL))
+    if status[1] != 200:
+        return status
+
+    return ('OK', 200)
+
+
+async def batch_interface(items, access_token, statuses=None):
+    """
+    Async version of main.batch_interface.
+    Devices are processed concurrently, events of one device in order.
+
+    """
+
+    statuses = list(statuses) if statuses != None else [None] * len(items)
+
+    # group events by project and device
+    groups = {}
+    for i, item in enumerate(items):
+        if statuses[i] != None:
+            continue
+        target = item['event']['targetName'].split('/') if main.well_formed_event(item) else []
+        if len(target) < 2:
+            statuses[i] = ('malformed event', 400)
+            continue
+        groups.setdefault((target[1], target[-1]), []).append(i)
+
+    # one index per project, shared by all its devices
+    indexes = {}
+    for project_id, _ in groups.keys():
+        if project_id not in indexes:
+            with trace.span('index'):
+                indexes[project_id] = await run_sync(main.project_index, project_id, access_token)
+
+    async def process_device(project_id, group):
+        for i in group:
+            # skip events processed by an earlier delivery
+            if dedup.seen(main.event_identifier(items[i])):
+                statuses[i] = ('duplicate event', 200)
+                continue
+            try:
+                statuses[i] = await api_interface(items[i]['event'], items[i]['labels'], access_token,
+                                                  indexes[project_id])
+                if statuses[i][1] == 200:
+                    dedup.mark(main.event_identifier(items[i]))
+            except http.CircuitOpenError as e:
+                statuses[i] = ('ERROR: {}'.format(e), 503)
+            except Exception as e:
+                statuses[i] = ('ERROR: {}'.format(e), 500)
+
+    await asyncio.gather(*[process_device(project_id, group) for (project_id, _), group in groups.items()])
+
+    # publish values held back during the batch
+    await run_sync(emission.flush, True)
+
+    print('-- Processed batch of {} events.'.format(len(items)))
+    return main.batch_response(statuses)
+
+
+async def main_async(request):
+    """
+    Async version of main.main, for ASGI servers.
+
+    Parameters
+    ----------
+    request : object
+        HTTP POST request received, with headers, get_data() and get_json().
+
+    Returns
+    -------
+    status : tuple
+        Tuple with 2 cells containing status text [0] and status code [1].
+
+    """
+
+    # time the execution
+    start = time.perf_counter()
+    trace.start()
+    http.start_deadline()
+
+    # logging frame start
+    print('START' + '-'*50)
+
+    # publish values of expired coalescing windows
+    await run_sync(emission.flush)
+
+    # read body once, hashed while it is read
+    try:
+        data, checksum = request_body.read(request)
+    except request_body.BodyTooLarge as e:
+        return main.terminate(('ERROR: {}'.format(e), 413), time.perf_counter()-start)
+
+    # validate secret etc
+    with trace.span('validate'):
+        status = auth.project_validate(request, main.DT_SIGNATURE_HEADER, main.DT_SIGNATURE_SECRET, checksum)
+    if status[1] != 200:
+        return main.terminate(status, time.perf_counter()-start)
+
+    # parse the validated body, handed through the pipeline from here
+    try:
+        body = request_body.parse(data)
+    except ValueError:
+        return main.terminate(('malformed body', 400), time.perf_counter()-start)
+    if not main.well_formed(body):
+        return main.terminate(('malformed body', 400), time.perf_counter()-start)
+
+    # answer retried events without touching the API
+    if isinstance(body, dict) and dedup.seen(main.event_identifier(body)):
+        return main.terminate(('duplicate event', 200), time.perf_counter()-start)
+
+    # answer events that cannot cause work without authenticating
+    status, skips = main.prefilter_request(body)
+    if status != None:
+        return main.terminate(status, time.perf_counter()-start)
+
+    # short-circuit re-delivered requests before any API work
+    replay = auth.claim_request(checksum)
+    if replay == 'done':
+        return main.terminate(('duplicate request', 200), time.perf_counter()-start)
+    if replay == 'pending':
+        return main.terminate(('duplicate request in progress', 409), time.perf_counter()-start)
+
+    # release the claim unless processed successfully, so retries go through
+    status = None
+    try:
+        # authenticate to service account, reusing token across warm invocations
+        with trace.span('token'):
+            access_token = await run_sync(auth.cached_service_account_token,
+                                          main.SERVICE_ACCOUNT_EMAIL,
+                                          main.SERVICE_ACCOUNT_KEY_ID,
+                                          main.SERVICE_ACCOUNT_SERCRET,
+                                          main.AUTH_ENDPOINT)
+        if access_token == None:
+            status = ('Not Authenticated', 401)
+
+        # talk to api, once per event in batch requests
+        elif isinstance(body, list):
+            status = await batch_interface(body, access_token, skips)
+        else:
+            status = await api_interface(body['event'], body['labels'], access_token)
+            if status[1] == 200:
+                dedup.mark(main.event_identifier(body))
+    except http.CircuitOpenError as e:
+        status = ('ERROR: {}'.format(e), 503)
+    except ahttp.transport_errors() as e:
+        status = ('ERROR: {}'.format(str(e) or type(e).__name__), 504 if ahttp.is_timeout(e) else 503)
+    finally:
+        auth.settle_request(checksum, status != None and status[1] == 200)
+
+    # success
+    return main.terminate(status, time.perf_counter()-start)
+
+
+class ASGIRequest:
+    """
+    Minimal request built from an ASGI scope and body.
+    Offers the request interface used by main_async and project_validate.
+
+    """
+
+    def __init__(self, scope, body):
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.body    = body
+
+    def get_data(self):
+        return self.body
+
+    def get_json(self):
+        return json.loads(self.body)
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application serving main_async, e.g. uvicorn main_async:app.
+
+    """
+
+    # close the shared session at shutdown
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await ahttp.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # instance metrics for scraping
+    if scope['path'] == '/metrics' and scope['method'] == 'GET':
+        payload = trace.prometheus({'inertia_emits_total':     emission.emit_stats,
+                                     'inertia_events_total':    dedup.dedup_stats,
+                                     'inertia_prefilter_total': main.prefilter_stats}).encode()
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8'),
+                                (b'content-length', str(len(payload)).encode())]})
+        await send({'type': 'http.response.body', 'body': payload})
+        return
+
+    # read full request body, refusing oversized ones before reading on
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > request_body.MAX_BODY_SIZE:
+            text, code = 'ERROR: body exceeds {} bytes'.format(request_body.MAX_BODY_SIZE), 413
+            break
+        if not message.get('more_body', False):
+            text, code = await main_async(ASGIRequest(scope, bytes(body)))
+            break
+
+    payload = text.encode()
+    await send({'type': 'http.response.start', 'status': code,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                            (b'content-length', str(len(payload)).encode())]})
+    await send({'type': 'http.response.body', 'body': payload})
@@ -0,0 +1,45 @@
+# packages
+import os
+import sys
+import pytest
+
+# project
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import fake_dt
+import helpers.dedup        as dedup
+import helpers.session      as http
+import helpers.registry     as reg
+import helpers.authenticate as auth
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """
+    Reset the module level caches shared across warm invocations.
+
+    """
+
+    http.breakers.clear()
+    http.deadline.set(None)
+    reg.clear()
+    auth.replay_cache.clear()
+    dedup.store = None
+    yield
+    http.deadline.set(None)
+
+
+@pytest.fixture
+def dt():
+    """
+    Fake DT served on a free port, its API base URL in dt.base.
+
+    """
+
+    state = fake_dt.FakeDT()
+    server = fake_dt.serve(state)
+    state.base = 'http://{}:{}/v2'.format(*server.server_address)
+    yield state
+    server.shutdown()
+    server.server_close()
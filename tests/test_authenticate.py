@@ -0,0 +1,43 @@
+# packages
+import time
+import jwt
+import pytest
+
+# project
+import helpers.authenticate as auth
+
+SECRET = 'signature-secret-of-at-least-32-bytes'
+
+
+@pytest.mark.parametrize('segment, decoded', [
+    (b'YWJj', b'abc'),
+    (b'YWI', b'ab'),
+    (b'-_-_', b'\xfb\xff\xbf'),
+    (b'', b''),
+])
+def test_b64url_decode(segment, decoded):
+    assert auth.b64url_decode(segment) == decoded
+
+
+@pytest.mark.parametrize('segment', [b'YW+j', b'YW/j', b'YWI=', b'YW j', b'YW\nj', b'Y'])
+def test_b64url_decode_rejects_other_alphabets(segment):
+    with pytest.raises(ValueError):
+        auth.b64url_decode(segment)
+
+
+def test_verify_hs256():
+    token = jwt.encode({'checksum': 'abc', 'exp': time.time() + 60}, SECRET, algorithm='HS256')
+    token = token.decode() if isinstance(token, bytes) else token
+
+    assert auth.verify_hs256(token, SECRET)['checksum'] == 'abc'
+    assert auth.verify_hs256(token, 'other') == None
+    assert auth.verify_hs256(token + '=', SECRET) == None
+    assert auth.verify_hs256(token.replace('.', '+.', 1), SECRET) == None
+
+
+@pytest.mark.parametrize('claims', [{'exp': 0}, {'nbf': time.time() + 60}, {'exp': 'soon'}, {'exp': None}])
+def test_verify_hs256_time_claims(claims):
+    token = jwt.encode(claims, SECRET, algorithm='HS256')
+    token = token.decode() if isinstance(token, bytes) else token
+
+    assert auth.verify_hs256(token, SECRET) == None
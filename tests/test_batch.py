@@ -0,0 +1,93 @@
+# packages
+import json
+import pytest
+
+# project
+import main
+import helpers.session as http
+
+
+def temperature_event(device_id, value, labels, event_id=None):
+    return {
+        'event': {
+            'eventId':    event_id,
+            'targetName': 'projects/project/devices/{}'.format(device_id),
+            'eventType':  'temperature',
+            'data':       {'temperature': {'value': value, 'updateTime': '2020-10-19T12:34:56.123456789Z'}},
+        },
+        'labels': labels,
+    }
+
+
+@pytest.fixture
+def api(dt, monkeypatch):
+    monkeypatch.setattr(main, 'API_URL_BASE', dt.base)
+    monkeypatch.setattr(main, 'EMU_URL_BASE', dt.base)
+    monkeypatch.setattr(http, 'HTTP_RETRIES', 0)
+    return dt
+
+
+def test_batch_response_combines_codes():
+    assert main.batch_response([('OK', 200), ('malformed event', 400)])[1] == 200
+    assert main.batch_response([('OK', 200), ('ERROR', 500), ('ERROR', 503)])[1] == 503
+    assert main.batch_response([('ERROR', 429), ('malformed event', 400)])[1] == 429
+    assert main.batch_response([])[1] == 200
+
+    body, _ = main.batch_response([('OK', 200), ('ERROR', 500)])
+    assert json.loads(body) == [{'status': 'OK', 'code': 200}, {'status': 'ERROR', 'code': 500}]
+
+
+@pytest.mark.parametrize('item', [
+    None,
+    [],
+    {'event': {'eventType': 'temperature', 'targetName': 'projects/project/devices/d'}},
+    {'labels': {}, 'event': {'targetName': 'projects/project/devices/d'}},
+    {'labels': {}, 'event': {'eventType': 'temperature'}},
+    {'labels': {}, 'event': {'eventType': 'temperature', 'targetName': 'nodevice'}},
+])
+def test_malformed_items_answer_400_without_api_calls(api, item):
+    body, code = main.batch_interface([item], 'token')
+
+    assert code == 200
+    assert json.loads(body) == [{'status': 'malformed event', 'code': 400}]
+    assert api.calls == {}
+
+
+def test_batch_spawns_and_updates_twin(api):
+    labels = {main.EMULATION_LABEL: '0.1'}
+    device_id = api.populate('project', 1)[0]
+    items = [temperature_event(device_id, 20.0, labels, 'a'), temperature_event(device_id, 21.0, labels, 'b')]
+
+    body, code = main.batch_interface(items, 'token')
+
+    assert code == 200
+    assert [status['code'] for status in json.loads(body)] == [200, 200]
+    assert api.calls['create'] == 1
+
+
+def test_batch_retryable_failure_answers_5xx(api):
+    labels = {main.EMULATION_LABEL: '0.1'}
+    device_id = api.populate('project', 1)[0]
+    items = [
+        temperature_event(device_id, 20.0, labels, 'a'),
+        {'labels': {}, 'event': {'eventType': 'temperature'}},
+    ]
+
+    api.error_rate = 1.0
+    body, code = main.batch_interface(items, 'token')
+
+    codes = [status['code'] for status in json.loads(body)]
+    assert codes[0] >= 500 and codes[1] == 400
+    assert code == codes[0]
+
+
+def test_batch_skips_events_processed_before(api):
+    labels = {main.EMULATION_LABEL: '0.1'}
+    device_id = api.populate('project', 1)[0]
+    items = [temperature_event(device_id, 20.0, labels, 'a')]
+
+    main.batch_interface(items, 'token')
+    body, code = main.batch_interface(items, 'token')
+
+    assert code == 200
+    assert json.loads(body) == [{'status': 'duplicate event', 'code': 200}]
@@ -0,0 +1,33 @@
+# project
+import helpers.registry as reg
+
+
+def test_lookup_index_fetches_by_identifier_and_label(dt):
+    device_ids = dt.populate('project', 1000)
+    target_id = device_ids[500]
+    dt.add_device('project', 'emutarget', {'name': 'target twin', reg.ORIGINAL_DEVICE_LABEL: target_id})
+
+    index = reg.lookup_index(dt.base, 'project', target_id, 'token')
+
+    assert sorted(index['devices']) == sorted([target_id, 'emutarget'])
+    assert list(index['twins'][target_id]) == ['emutarget']
+    assert dt.calls == {'get': 1, 'list_filtered': 1}
+
+
+def test_fetch_twins_uses_label_filter(dt):
+    device_ids = dt.populate('project', 1000)
+    dt.add_device('project', 'emuother', {'name': 'other twin', reg.ORIGINAL_DEVICE_LABEL: device_ids[0]})
+
+    twins = reg.fetch_twins(dt.base, 'project', device_ids[0], 'token')
+
+    assert [reg.device_identifier(twin) for twin in twins] == ['emuother']
+    assert dt.calls == {'list_filtered': 1}
+
+
+def test_lookup_index_of_unknown_device(dt):
+    dt.populate('project', 10)
+
+    index = reg.lookup_index(dt.base, 'project', 'missing', 'token')
+
+    assert index['devices'] == {} and index['twins'] == {}
+    assert 'list' not in dt.calls
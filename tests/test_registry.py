@@ -0,0 +1,59 @@
+# project
+import helpers.registry as reg
+
+
+def device(device_id, original_id=None):
+    labels = {} if original_id == None else {reg.ORIGINAL_DEVICE_LABEL: original_id}
+    return {'name': 'projects/project/devices/{}'.format(device_id), 'labels': labels}
+
+
+def test_patches_during_refresh_carry_over(monkeypatch):
+    previous = reg.build_index([device('sensor'), device('emuold', 'sensor')])
+    reg.registries['project'] = previous
+
+    # twins spawned and deleted by other executions while the list is fetched
+    def iter_devices(*args, **kwargs):
+        yield device('sensor')
+        reg.index_device(previous, device('emunew', 'sensor'))
+        reg.remove_device(previous, 'emuold')
+        yield device('emuold', 'sensor')
+
+    monkeypatch.setattr(reg, 'iter_devices', iter_devices)
+    index = reg.refresh_index('base', 'project', 'token')
+
+    assert reg.registries['project'] is index
+    assert sorted(index['devices']) == ['emunew', 'sensor']
+    assert list(index['twins']['sensor']) == ['emunew']
+    assert previous['journal'] == None and previous['successor'] is index
+
+
+def test_patches_after_swap_are_forwarded(monkeypatch):
+    previous = reg.build_index([device('sensor')])
+    reg.registries['project'] = previous
+    monkeypatch.setattr(reg, 'iter_devices', lambda *args, **kwargs: iter([device('sensor')]))
+    index = reg.refresh_index('base', 'project', 'token')
+
+    # an execution still holding the replaced index spawns a twin
+    reg.index_device(previous, device('emunew', 'sensor'))
+    assert list(index['twins']['sensor']) == ['emunew']
+
+    reg.remove_device(previous, 'emunew')
+    assert 'emunew' not in index['devices'] and 'sensor' not in index['twins']
+
+
+def test_failed_refresh_stops_journal(monkeypatch):
+    previous = reg.build_index([device('sensor')])
+    reg.registries['project'] = previous
+
+    def iter_devices(*args, **kwargs):
+        raise RuntimeError('device list request failed with status 503')
+        yield
+
+    monkeypatch.setattr(reg, 'iter_devices', iter_devices)
+    try:
+        reg.refresh_index('base', 'project', 'token')
+    except RuntimeError:
+        pass
+
+    assert previous['journal'] == None
+    assert reg.registries['project'] is previous
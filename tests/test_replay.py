@@ -0,0 +1,57 @@
+# packages
+import time
+
+# project
+import helpers.dedup        as dedup
+import helpers.authenticate as auth
+
+
+def test_claim_is_pending_until_settled():
+    assert auth.claim_request('checksum') == None
+    assert auth.claim_request('checksum') == 'pending'
+
+    auth.settle_request('checksum', True)
+    assert auth.claim_request('checksum') == 'done'
+
+
+def test_failed_request_is_released():
+    assert auth.claim_request('checksum') == None
+
+    auth.settle_request('checksum', False)
+    assert auth.claim_request('checksum') == None
+
+
+def test_claims_expire(monkeypatch):
+    monkeypatch.setattr(auth, 'REPLAY_TTL', 0.05)
+    auth.claim_request('checksum')
+    auth.settle_request('checksum', True)
+
+    time.sleep(0.06)
+    assert auth.claim_request('checksum') == None
+
+
+def test_dedup_marks_only_identified_events():
+    assert not dedup.seen('event')
+    dedup.mark('event')
+    assert dedup.seen('event')
+
+    dedup.mark(None)
+    assert not dedup.seen(None)
+
+
+def test_memory_store_evicts_oldest():
+    store = dedup.MemoryStore(2, 60)
+    for event_id in ('a', 'b', 'c'):
+        store.mark(event_id)
+
+    assert not store.seen('a')
+    assert store.seen('b') and store.seen('c')
+
+
+def test_sqlite_store_forgets_expired(tmp_path):
+    store = dedup.SQLiteStore(str(tmp_path / 'dedup'), 0.05)
+    store.mark('event')
+    assert store.seen('event')
+
+    time.sleep(0.06)
+    assert not store.seen('event')
@@ -0,0 +1,93 @@
+# packages
+import time
+import pytest
+import requests
+
+# project
+import helpers.session as http
+
+
+def test_breaker_opens_after_threshold():
+    breaker = http.CircuitBreaker(2, 60)
+
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_failures():
+    breaker = http.CircuitBreaker(2, 60)
+
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.allow()
+
+
+def test_breaker_lets_single_trial_through_after_cooldown():
+    breaker = http.CircuitBreaker(1, 0.05)
+    breaker.failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # a successful trial closes the circuit
+    breaker.success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_failed_trial_reopens():
+    breaker = http.CircuitBreaker(1, 0.05)
+    breaker.failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+def test_request_fails_fast_while_open(dt, monkeypatch):
+    monkeypatch.setattr(http, 'HTTP_RETRIES', 0)
+    dt.populate('project', 1)
+    url = '{}/projects/project/devices/dev000000'.format(dt.base)
+    breaker = http.get_breaker(url)
+    breaker.threshold, breaker.cooldown = 1, 60
+
+    dt.error_rate = 1.0
+    assert http.get(url).status_code == 503
+    with pytest.raises(http.CircuitOpenError):
+        http.get(url)
+    assert dt.calls == {'error': 1}
+
+
+def test_deadline_miss_keeps_trial(dt):
+    dt.populate('project', 1)
+    url = '{}/projects/project/devices/dev000000'.format(dt.base)
+    breaker = http.get_breaker(url)
+    breaker.threshold, breaker.cooldown = 1, 0
+    breaker.failure()
+
+    # the deadline is checked before the half-open breaker hands out its trial
+    http.deadline.set(time.monotonic() - 1)
+    with pytest.raises(requests.Timeout):
+        http.get(url)
+    assert not breaker.trial
+
+    http.start_deadline(0)
+    assert http.get(url).status_code == 200
+    assert breaker.opened == None
+
+
+def test_retry_after_is_honoured(dt, monkeypatch):
+    monkeypatch.setattr(http, 'HTTP_RETRIES', 2)
+    dt.populate('project', 1)
+    url = '{}/projects/project/devices/dev000000'.format(dt.base)
+
+    dt.error_rate = 1.0
+    assert http.get(url).status_code == 503
+    assert dt.calls == {'error': 3}
@@ -0,0 +1,63 @@
+# packages
+import asyncio
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# project
+import helpers.session       as http
+import helpers.session_async as ahttp
+
+
+class ThrottleHandler(BaseHTTPRequestHandler):
+    # answers every request with 503 and lowercase headers, the C parser of
+    # aiohttp only canonicalizes the case of well-known ones like Retry-After
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.calls += 1
+        self.send_response(503)
+        self.send_header('retry-after', '3600')
+        self.send_header('x-request-id', 'abc')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+@pytest.fixture
+def throttled():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottleHandler)
+    server.calls = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+async def get_and_close(url):
+    try:
+        return await ahttp.get(url)
+    finally:
+        await ahttp.close()
+
+
+def test_lowercase_retry_after_is_honoured(throttled, monkeypatch):
+    # a Retry-After beyond HTTP_BACKOFF_MAX is not waited for, so no retry
+    monkeypatch.setattr(http, 'HTTP_RETRIES', 2)
+    url = 'http://{}:{}/'.format(*throttled.server_address)
+
+    r = asyncio.run(get_and_close(url))
+
+    assert r.status_code == 503
+    assert r.headers.get('Retry-After') == '3600'
+    assert r.headers.get('X-Request-Id') == 'abc'
+    assert throttled.calls == 1
+
+
+def test_sync_lowercase_retry_after_is_honoured(throttled, monkeypatch):
+    monkeypatch.setattr(http, 'HTTP_RETRIES', 2)
+    url = 'http://{}:{}/'.format(*throttled.server_address)
+
+    assert http.get(url).status_code == 503
+    assert throttled.calls == 1